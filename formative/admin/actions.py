@@ -2,26 +2,34 @@ from django import forms
 from django.apps import apps
 from django.conf import settings
 from django.contrib import admin, auth, messages
-from django.contrib.admin.utils import NestedObjects
+from django.contrib.contenttypes.models import ContentType
 from django.core import exceptions, serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer as PythonSerializer
+from django.core.cache import cache
 from django.db import transaction, IntegrityError
-from django.db.models import Count, Max, Sum, Exists, OuterRef
-from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, HttpResponseRedirect, \
+    StreamingHttpResponse, FileResponse
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
+from django.utils import timezone
 from django.utils.text import capfirst
 from django.shortcuts import get_object_or_404
 from urllib.parse import quote
 from stream_zip import ZIP_64, stream_zip
 from datetime import datetime
 from pathlib import Path
-import csv, io, os
+import csv, io, itertools, json, os
 
 from ..forms import MoveBlocksAdminForm, EmailAdminForm, FormPluginsAdminForm, \
     UserImportForm, ExportAdminForm
-from ..models import Form, FormBlock, SubmissionRecord
-from ..tasks import send_email_for_submissions
-from ..utils import TabularExport, delete_submission_files, get_current_site
+from ..models import Program, Form, FormBlock, CustomBlock, CollectionBlock, \
+    FormLabel, FormDependency, SubmissionRecord, FilesExport
+from ..tasks import send_email_campaign, create_email_campaign, \
+    build_files_export, purge_submission_files
+from ..utils import TabularExport, get_current_site, submission_file_paths, \
+    read_ahead
 
 
 class UserActionsMixin:
@@ -102,12 +110,20 @@ class UserActionsMixin:
         return TemplateResponse(request, template_name, context)
 
 
-class NonPolymorphicNestedObjects(NestedObjects):
-    def related_objects(self, related_model, related_fields, objs):
-        qs = super().related_objects(related_model, related_fields, objs)
-        # somehow, the dumpdata management command doesn't have this problem
-        if hasattr(qs, 'non_polymorphic'): return qs.non_polymorphic()
-        return qs
+class FormSerializer(PythonSerializer):
+    def handle_fk_field(self, obj, field):
+        if field.related_model is not FormBlock \
+           or not self.use_natural_foreign_keys:
+            return super().handle_fk_field(obj, field)
+        
+        # polymorphic's parent link accessor fetches the parent block, but the
+        # child's natural key is the same as its parent's
+        if field.remote_field.parent_link: block = obj
+        else: block = getattr(obj, field.name)
+        # block names aren't unique within a form, so the page and rank are
+        # added to the key; FormBlockManager.get_by_natural_key accepts them
+        key = block and block.natural_key() + (block.page, block._rank)
+        self._current[field.name] = key
 
 
 class FormActionsMixin:
@@ -140,14 +156,8 @@ class FormActionsMixin:
 #            return TemplateResponse(request, 'admin/publish_confirmation.html',
 #                                    context)
         if '_unpublish' in request.POST:
-            subs = []
             if obj.status != Form.Status.DRAFT:
-                qs = obj.model.objects.all()
-                if obj.item_model:
-                    qs = qs.annotate(num_items=Count('_item'))
-                    subs = qs.values_list('_email', 'num_items')
-                else: subs = qs.values_list('_email')
-            context['submissions'] = subs
+                context.update(self.unpublish_summary(obj))
             model_name = obj.model._meta.model_name
             context['link_name'] = f'admin:formative_{model_name}_changelist'
             request.current_app = self.admin_site.name
@@ -156,6 +166,29 @@ class FormActionsMixin:
         
         return super().response_change(request, obj)
     
+    def unpublish_summary(self, form, sample_size=10):
+        # submission totals in a single query, then the items table's
+        qs = form.model.objects.order_by()
+        totals = qs.aggregate(total=Count('*'), submitted=Count('_submitted'))
+        totals['drafts'] = totals['total'] - totals['submitted']
+        if form.item_model: totals['items'] = form.item_model.objects.count()
+        
+        # the full, paginated list is the submissions changelist
+        sample = list(qs.order_by('-_created')[:sample_size]
+                      .values_list('_id', '_email'))
+        counts = {}
+        if form.item_model and sample:
+            items = form.item_model.objects.filter(
+                _submission__in=[ sub_id for sub_id, _ in sample ]
+            ).order_by().values_list('_submission')
+            counts = dict(items.annotate(count=Count('*')))
+        
+        return {
+            'totals': totals, 'more': totals['total'] - len(sample),
+            'submissions': [ (email, counts.get(sub_id))
+                             for sub_id, email in sample ]
+        }
+    
     @admin.action(description='Enable/disable a plugin')
     def form_plugins(self, request, queryset):
         if '_submit' in request.POST:
@@ -182,20 +215,127 @@ class FormActionsMixin:
         }
         return TemplateResponse(request, template_name, context)
     
-    def form_objects(self, queryset):
-        collector = NonPolymorphicNestedObjects(using='default')
-        collector.collect(queryset)
-        models = serializers.sort_dependencies([(None, collector.data.keys())])
-        return [ obj for cls in models for obj in collector.data[cls]
-                 if cls._meta.app_label == 'formative' ]
+    def form_objects(self, queryset, chunk_size=500):
+        # the form definition graph, model by model in dependency order. what
+        # the natural keys need is joined in, and rows are read in chunks
+        forms = Form.objects.filter(pk__in=queryset.values('pk'))
+        querysets = (
+            forms.select_related('program'),
+            FormLabel.objects.filter(form__in=forms)
+                .select_related('form__program'),
+            FormBlock.objects.non_polymorphic().filter(form__in=forms)
+                .select_related('polymorphic_ctype', 'form__program',
+                                'dependence__form__program'),
+            CustomBlock.objects.non_polymorphic().filter(form__in=forms)
+                .select_related('form__program'),
+            CollectionBlock.objects.non_polymorphic().filter(form__in=forms)
+                .select_related('form__program'),
+            FormDependency.objects.filter(block__form__in=forms)
+                .select_related('block__form__program'),
+        )
+        for qs in querysets:
+            yield from qs.order_by('pk').iterator(chunk_size=chunk_size)
+    
+    def form_records(self, queryset, chunk_size=500):
+        objects = self.form_objects(queryset, chunk_size=chunk_size)
+        while (chunk := list(itertools.islice(objects, chunk_size))):
+            yield from FormSerializer().serialize(
+                chunk, use_natural_foreign_keys=True,
+                use_natural_primary_keys=True
+            )
+    
+    def import_form_records(self, records, form_fields={}):
+        # the counterpart of form_records, creating each model's objects with
+        # one bulk insert. form_fields replace those of the form in the records
+        # this skips Form.save(), RankedModel.save(), validate_unique and the
+        # signals: slugs and ranks are taken as they are in the records, and
+        # labels aren't generated per block but come with the rest of the graph
+        by_model = {}
+        for record in records:
+            by_model.setdefault(record['model'], []).append(record['fields'])
+        
+        def build(model, fields, **values):
+            obj = model(**values)
+            for name, value in fields.items():
+                field = model._meta.get_field(name)
+                if field.is_relation or field.many_to_many: continue
+                setattr(obj, field.attname, field.to_python(value))
+            return obj
+        
+        programs, forms = {}, {}
+        for fields in by_model.get('formative.form', []):
+            key = tuple(fields['program'])
+            if key not in programs:
+                programs[key] = Program.objects.get_by_natural_key(*key)
+            form = build(Form, {**fields, **form_fields},
+                         program=programs[key])
+            forms[key + (fields['slug'],)] = form
+        Form.objects.bulk_create(forms.values())
+        
+        # blocks are referred to by name, page and rank. older exports only
+        # have the name, which is ambiguous when the name isn't unique
+        block_fields = by_model.get('formative.formblock', [])
+        created, blocks, named = [], {}, {}
+        for fields in block_fields:
+            ctype = ContentType.objects.get_by_natural_key(
+                *fields['polymorphic_ctype']
+            )
+            key = tuple(fields['form']) + (fields['name'],)
+            block = build(FormBlock, fields, polymorphic_ctype=ctype,
+                          dependence=None, form=forms[key[:-1]])
+            blocks[key + (fields['page'], fields['_rank'])] = block
+            named.setdefault(key, []).append(block)
+            created.append(block)
+        FormBlock.objects.bulk_create(created)
+        
+        def find_block(key):
+            key = tuple(key)
+            return blocks.get(key) or named[key][0]
+        
+        # dependences can point at any block, so they're set once all exist
+        dependent = []
+        for fields, block in zip(block_fields, created):
+            if not fields['dependence']: continue
+            block.dependence = find_block(fields['dependence'])
+            dependent.append(block)
+        if dependent: FormBlock.objects.bulk_update(dependent, ['dependence'])
+        
+        for model in (CustomBlock, CollectionBlock):
+            # with older exports, child records come in the parents' order
+            ctype = ContentType.objects.get_for_model(model)
+            parents = { key: iter([ b for b in same_name
+                                    if b.polymorphic_ctype_id == ctype.id ])
+                        for key, same_name in named.items() }
+            for fields in by_model.get(model._meta.label_lower, []):
+                key = tuple(fields['block'])
+                parent = blocks.get(key) or next(parents[key])
+                # bulk_create refuses multi-table inheritance. the parent rows
+                # are in already, and a raw save inserts just the child's row
+                child = build(model, fields, block_id=parent.pk)
+                child.save_base(raw=True, force_insert=True)
+        
+        FormLabel.objects.bulk_create([
+            build(FormLabel, fields, form=forms[tuple(fields['form'])])
+            for fields in by_model.get('formative.formlabel', [])
+        ])
+        FormDependency.objects.bulk_create([
+            build(FormDependency, fields, block=find_block(fields['block']))
+            for fields in by_model.get('formative.formdependency', [])
+        ])
+        return list(forms.values())
     
     @admin.action(description='Export selected forms as JSON')
     def export_json(self, request, queryset):
-        response = HttpResponse(content_type='text/javascript')
-        serializers.serialize('json', self.form_objects(queryset),
-                              use_natural_foreign_keys=True,
-                              use_natural_primary_keys=True, stream=response)
+        def stream():
+            yield '['
+            for i, record in enumerate(self.form_records(queryset)):
+                yield (i and ',\n' or '\n') + json.dumps(
+                    record, cls=DjangoJSONEncoder, ensure_ascii=False
+                )
+            yield '\n]\n'
         
+        response = StreamingHttpResponse(stream(),
+                                         content_type='text/javascript')
         if len(queryset) == 1: filename = f'{queryset[0].slug}_export.json'
         else: filename = f'{queryset[0].program.slug}_selected__export.json'
         disp = f"attachment; filename*=UTF-8''" + quote(filename)
@@ -206,23 +346,15 @@ class FormActionsMixin:
     def duplicate(self, request, queryset):
         form = queryset[0]
         if '_duplicate' in request.POST:
-            new = None
+            slug = request.POST['new_slug']
+            form_fields = {
+                'slug': slug, 'db_slug': slug.lower().replace('-', ''),
+                'name': request.POST['new_name'], 'status': Form.Status.DRAFT,
+                'completed': None
+            }
             with transaction.atomic():
-                form.slug = request.POST['new_slug']
-                form.name = request.POST['new_name']
-                form.save()
-                
-                related = self.form_objects(Form.objects.filter(pk=form.pk))
-                new = serializers.serialize('json', related,
-                                            use_natural_foreign_keys=True,
-                                            use_natural_primary_keys=True)
-                transaction.set_rollback(True)
-            
-            with transaction.atomic():
-                for obj in serializers.deserialize('json', new):
-                    if obj.object._meta.model_name == 'form':
-                        obj.object.status = Form.Status.DRAFT
-                    obj.save()
+                records = self.form_records(Form.objects.filter(pk=form.pk))
+                self.import_form_records(records, form_fields=form_fields)
             
             self.message_user(request, 'Form copied.', messages.SUCCESS)
             return HttpResponseRedirect(request.get_full_path())
@@ -247,18 +379,24 @@ class FormActionsMixin:
 class FormBlockActionsMixin:
     @admin.action(description='Move to different page')
     def move_blocks_action(self, request, queryset):
-        if '_move' in request.POST:
-            page, n = request.POST['page'], 0
-            blocks, cur_page = queryset[0].form.blocks, queryset[0].page
-            last_rank_q = blocks.filter(page=cur_page).aggregate(r=Max('_rank'))
-            last_rank = last_rank_q['r']
-            for block in cur_page and queryset.order_by('_rank') or []:
-                block = FormBlock.objects.get(pk=block.pk) # clear side effects;
-                block._rank = last_rank
-                block.save() # it's now at the end of its page; and
-                block.page, block._rank = page, None # then move to the new one,
-                block.save() # so that the others on the old page are left sorted
-                n, last_rank = n + 1, last_rank - 1
+        blocks = list(queryset.select_related('form', 'dependence')
+                      .prefetch_related('dependents'))
+        form, cur_page = blocks[0].form, blocks[0].page
+        min_page = max(block.min_allowed_page() for block in blocks)
+        last_page = form.blocks.aggregate(p=Max('page'))['p']
+        max_page = min(block.max_allowed_page(last_page) for block in blocks)
+        new = max_page == last_page
+        movable = form.status == Form.Status.DRAFT
+        
+        data = '_move' in request.POST and request.POST or None
+        move_form = MoveBlocksAdminForm(max_page, min_page=min_page,
+                                        new_page=new, data=data,
+                                        from_pages=[ b.page for b in blocks ])
+        if movable and move_form.is_valid():
+            page, n = move_form.cleaned_data['page'], 0
+            if cur_page:
+                block_ids = [ block.pk for block in blocks ]
+                n = form.move_blocks(block_ids, page, cur_page)
             
             msg = f'Moved {n} blocks to page {page}'
             if n: self.message_user(request, msg, messages.SUCCESS)
@@ -267,17 +405,11 @@ class FormBlockActionsMixin:
         
         template_name = 'admin/formative/move_page.html'
         request.current_app = self.admin_site.name
-        min_page = max(block.min_allowed_page() for block in queryset)
-        last_page = queryset[0].form.blocks.aggregate(p=Max('page'))['p']
-        max_page = min(block.max_allowed_page(last_page) for block in queryset)
-        new = max_page == last_page
         context = {
             **self.admin_site.each_context(request),
             'opts': self.model._meta, 'media': self.media,
-            'blocks': queryset, 'title': 'Move Blocks',
-            'movable': queryset[0].form.status == Form.Status.DRAFT,
-            'form': MoveBlocksAdminForm(max_page,
-                                        min_page=min_page, new_page=new),
+            'blocks': blocks, 'title': 'Move Blocks', 'movable': movable,
+            'form': move_form,
         }
         return TemplateResponse(request, template_name, context)
 
@@ -286,11 +418,12 @@ class SubmissionActionsMixin:
     @admin.action(description='Send an email to applicants')
     def send_email(self, request, queryset):
         if '_send' in request.POST:
-            send_email_for_submissions.delay(
-                queryset.model._meta.model_name,
-                list(queryset.values_list('pk', flat=True)),
+            program_form = queryset.model._get_form()
+            campaign = create_email_campaign(
+                program_form, queryset.values_list('pk', flat=True),
                 request.POST['subject'], request.POST['content']
             )
+            send_email_campaign.delay(str(campaign.id))
             msg = f'Email sending started for {queryset.count()} recipients.'
             self.message_user(request, msg, messages.SUCCESS)
             
@@ -308,7 +441,7 @@ class SubmissionActionsMixin:
         }
         return TemplateResponse(request, template_name, context)
     
-    @admin.action(description='Export submissions as CSV')
+    @admin.action(description='Export submissions')
     def export_csv(self, request, queryset):
         program_form = queryset.model._get_form()
         if '_export' in request.POST:
@@ -316,8 +449,11 @@ class SubmissionActionsMixin:
                      if k.startswith('block_') or k.startswith('collection_')
                         or k.startswith('cfield_') }
             export = TabularExport(program_form, queryset, **args)
-            filename = f'{program_form.slug}_export_selected.csv'
-            return export.csv_response(filename, queryset)
+            filename = f'{program_form.slug}_export_selected'
+            format = request.POST.get('format', 'csv')
+            if format in ('parquet', 'arrow'):
+                return export.columnar_response(filename, queryset, format)
+            return export.csv_response(filename + '.csv', queryset)
         
         template_name = 'admin/formative/export_submissions.html'
         context = {
@@ -344,20 +480,24 @@ class SubmissionActionsMixin:
         
         obj_dir = os.path.join(settings.MEDIA_ROOT, str(obj._id))
         submit_file = os.path.join(obj_dir, 'submitted')
-        if action == 'submit':
-            if not rec: obj._get_form().submit_submission(obj)
-            else:
-                obj._submit()
-                rec.deleted = False
-                
-                if os.path.isdir(obj_dir): Path(submit_file).touch()
-        else:
-            obj._submitted = None
-            obj.save()
+        try:
+            if action == 'submit' and not rec:
+                obj._get_form().submit_submission(obj)
+            elif action == 'submit': obj._submit()
+            else: obj._unsubmit()
+        except exceptions.ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+        
+        if action == 'unsubmit':
             if rec: rec.deleted = True
             
             if os.path.isdir(obj_dir):
                 if os.path.exists(submit_file): os.remove(submit_file)
+        elif rec:
+            rec.deleted = False
+            
+            if os.path.isdir(obj_dir): Path(submit_file).touch()
         if rec: rec.save()
         
         self.log_change(request, obj, action + 'ted')
@@ -390,24 +530,22 @@ class SubmissionActionsMixin:
             **self.admin_site.each_context(request), 'title': 'Manage Files',
             'opts': self.model._meta, 'media': self.media
         }
-        files_type = SubmissionRecord.RecordType.FILES
         
         if '_manage_submit' in request.POST:
             target = request.POST['manage_action']
             form = self.model._get_form()
-            sr = SubmissionRecord.objects.all()
+            progress = {'target': target, 'done': 0, 'last': 0,
+                        'total': None}
             
-            qs = sr.filter(program=form.program, form=form.slug, deleted=False,
-                           type=SubmissionRecord.RecordType.FILES)
-            q1 = self.model.objects.filter(_id=OuterRef('submission'))
-            q2 = sr.filter(submission=OuterRef('submission'), deleted=False,
-                           type=SubmissionRecord.RecordType.SUBMISSION)
-            if target == 'draft': qs = qs.exclude(Exists(q2)).filter(Exists(q1))
-            elif target == 'deleted': qs = qs.exclude(Exists(q1))
-            
-            delete_submission_files(qs) # TODO: should skip if item still exists
-            qs.update(deleted=True)
-            self.message_user(request, 'Files deleted.', messages.SUCCESS)
+            if not cache.add(form.files_purge_key(), progress,
+                             timeout=settings.FILES_PURGE_TIMEOUT):
+                self.message_user(request, 'Files are already being deleted.',
+                                  messages.WARNING)
+            else:
+                purge_submission_files.delay(form.id, target)
+                self.message_user(request, 'Deleting files in the background. '
+                                  'Progress is shown under Manage Files.',
+                                  messages.SUCCESS)
             return HttpResponseRedirect(request.get_full_path())
         
         if '_manage_files' in request.POST:
@@ -416,21 +554,11 @@ class SubmissionActionsMixin:
             
             form = self.model._get_form()
             context['program_form'] = form
-            sr = SubmissionRecord.objects.all()
             aggs = {'size': Sum('number'), 'count': Count('*')}
-            qs = sr.filter(program=form.program, form=form.slug,
-                           type=files_type, deleted=False)
-            context['total'] = qs.aggregate(**aggs)
-            
-            submission_type = SubmissionRecord.RecordType.SUBMISSION
-            model_subq = self.model.objects.filter(_id=OuterRef('submission'))
-            subq = sr.filter(submission=OuterRef('submission'),
-                             type=submission_type, deleted=False)
-            draft = qs.exclude(Exists(subq)).filter(Exists(model_subq))
-            context['draft'] = draft.aggregate(**aggs)
-            
-            deleted = qs.exclude(Exists(model_subq))
-            context['deleted'] = deleted.aggregate(**aggs)
+            for target in ('total', 'draft', 'deleted'):
+                qs = form.files_records(target)
+                context[target] = qs.aggregate(**aggs)
+            context['purge'] = form.files_purge_progress()
             
             return TemplateResponse(request, template_name, context)
         
@@ -439,12 +567,16 @@ class SubmissionActionsMixin:
     @admin.action(description='Download submission files')
     def download_files(self, request, queryset):
         template_name = 'admin/formative/files_download.html'
+        form = self.model._get_form()
+        exports = FilesExport.objects.filter(program=form.program,
+                                             form=form.slug, error='')
         context = {
             **self.admin_site.each_context(request),
             'opts': self.model._meta, 'media': self.media,
             'submissions': queryset, 'title': 'Download Submission Files',
+            'exports': exports.exclude(completed=None)[:20],
             'action': reverse('admin:formative_files_download',
-                              args=(self.model._get_form().pk,),
+                              args=(form.pk,),
                               current_app=self.admin_site.name)
         }
         return TemplateResponse(request, template_name, context)
@@ -455,40 +587,68 @@ def download_view(request, form_id):
     form = get_object_or_404(Form, id=form_id)
     item_model = form.item_model
     
+    since = None
+    if request.POST.get('since'):
+        since = get_object_or_404(FilesExport, id=request.POST['since'],
+                                  program=form.program, form=form.slug)
+    # a streamed download is only recorded once it has been sent in full
+    export = FilesExport(program=form.program, form=form.slug)
+    
     def files(selected, item_model):
         items = item_model.objects.filter(_submission__in=selected)
+        items = items.exclude(_file='').order_by('_submission')
+        # fetch the listing up front, so the reader thread needn't touch the db
+        files = list(items.values_list('_id', '_submission', '_file'))
+        paths = submission_file_paths(files, since=since and since.manifest,
+                                      manifest=export.manifest)
         
-        modified, last_sub = datetime.now(), None
-        for item in items.exclude(_file='').order_by('_submission'):
-            def file_data(path):
-                CHUNK_SIZE = 8192
-                with open(path, 'rb') as f:
-                    while True:
-                        data = f.read(CHUNK_SIZE)
-                        if not data: break
-                        yield data
-            
-            if last_sub is None or last_sub != item._submission_id:
-                sub_id = str(item._submission_id)
-                rel_path = os.path.join(sub_id, 'id.txt')
-                full_path = os.path.join(settings.MEDIA_ROOT, rel_path)
-                if os.path.exists(full_path):
-                    with open(full_path, 'rb') as f:
-                        yield rel_path, modified, 0o644, ZIP_64, [f.read()]
-                rel_path = os.path.join(sub_id, 'submitted')
-                full_path = os.path.join(settings.MEDIA_ROOT, rel_path)
-                if os.path.exists(full_path):
-                    yield rel_path, modified, 0o644, ZIP_64, [b'']
-            last_sub = item._submission_id
-            
-            data = file_data(item._file.path)
-            yield item._file.name, modified, 0o644, ZIP_64, data
+        modified = datetime.now()
+        for path, data in read_ahead(paths):
+            yield path, modified, 0o644, ZIP_64, data
+        
+        export.completed = timezone.now()
+        export.save()
     
     selected = request.POST.getlist('_selected_action')
+    if '_background' in request.POST:
+        export.save()
+        build_files_export.delay(str(export.id), selected,
+                                 since and str(since.id))
+        return HttpResponseRedirect(reverse('admin:formative_files_export',
+                                            args=(export.id,)))
+    
     response = StreamingHttpResponse(stream_zip(files(selected, item_model)),
                                      content_type='application/zip')
     
     filename = f'{form.slug}_files.zip'
+    if since: filename = f'{form.slug}_files_update.zip'
     disp = f"attachment; filename*=UTF-8''" + quote(filename)
     response['Content-Disposition'] = disp
     return response
+
+def export_view(request, export_id, admin_site=None):
+    export = get_object_or_404(FilesExport, id=export_id)
+    
+    if export.completed and os.path.isfile(export.path()):
+        if settings.EXPORTS_ACCEL_REDIRECT:
+            # nginx sends the file; the app worker is released right away
+            response = HttpResponse(content_type='application/zip')
+            response['X-Accel-Redirect'] = settings.EXPORTS_ACCEL_REDIRECT \
+                + export.file_name()
+        else:
+            response = FileResponse(open(export.path(), 'rb'),
+                                    content_type='application/zip')
+        
+        filename = f'{export.form}_files.zip'
+        disp = f"attachment; filename*=UTF-8''" + quote(filename)
+        response['Content-Disposition'] = disp
+        return response
+    
+    template_name = 'admin/formative/files_export.html'
+    request.current_app = admin_site.name
+    context = {
+        **admin_site.each_context(request),
+        'opts': FilesExport._meta, 'title': 'Download Submission Files',
+        'export': export, 'expired': bool(export.completed)
+    }
+    return TemplateResponse(request, template_name, context)
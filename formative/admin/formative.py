@@ -1,12 +1,16 @@
 from django import forms
 from django.contrib import admin, auth, sites
-from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.core.paginator import Paginator
 from django.db import connection
 from django.db.models import Count, F, Q
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import path, reverse, NoReverseMatch
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.utils.http import urlencode
 from django.utils.safestring import mark_safe
@@ -14,7 +18,7 @@ from django_better_admin_arrayfield.admin.mixins import DynamicArrayMixin
 from polymorphic.admin import (PolymorphicParentModelAdmin,
                                PolymorphicChildModelAdmin,
                                PolymorphicChildModelFilter)
-import types
+import types, uuid
 from functools import partial
 from urllib.parse import unquote, parse_qsl
 
@@ -23,15 +27,17 @@ from ..forms import ProgramAdminForm, FormAdminForm, DependencyAdminForm, \
     SubmissionAdminForm, SubmissionItemAdminForm, SiteAdminForm, \
     UserCreationAdminForm
 from ..models import Program, Form, FormLabel, FormBlock, FormDependency, \
-    CustomBlock, CollectionBlock, SubmissionRecord, Site
+    CustomBlock, CollectionBlock, SubmissionRecord, Site, EmailCampaign, \
+    EmailRecipient, OutboxEmail
 from ..filetype import FileType
 from ..plugins import get_matching_plugin
 from ..signals import register_program_settings, register_form_settings, \
     register_user_actions, form_published_changed, form_settings_changed
 from ..tasks import timed_complete_form
-from ..utils import submission_link, get_current_site, user_programs
+from ..utils import submission_link, get_current_site, user_programs, \
+    estimated_count, clear_site_cache
 from .actions import UserActionsMixin, FormActionsMixin,FormBlockActionsMixin, \
-    SubmissionActionsMixin, download_view
+    SubmissionActionsMixin, download_view, export_view
 
 
 class FormativeAdminSite(admin.AdminSite):
@@ -39,19 +45,26 @@ class FormativeAdminSite(admin.AdminSite):
         self.submissions_registered = None
         super().__init__(*args, **kwargs)
     
-    def register_submission_models(self):
-        for model in self.submissions_registered or {}:
+    def register_form_models(self, form):
+        # form id -> the form's registered models
+        for model in self.submissions_registered.pop(form.id, []):
             self.unregister(model)
+        if form.status == Form.Status.DRAFT: return
+        
+        self.register(form.model, SubmissionAdmin)
+        self.submissions_registered[form.id] = [form.model]
+        if form.item_model:
+            self.register(form.item_model, SubmissionItemAdmin)
+            self.submissions_registered[form.id].append(form.item_model)
+    
+    def register_submission_models(self):
+        for models in (self.submissions_registered or {}).values():
+            for model in models: self.unregister(model)
         self.submissions_registered = {}
         
         if Form._meta.db_table in connection.introspection.table_names():
             for form in Form.objects.exclude(status=Form.Status.DRAFT):
-                self.register(form.model, SubmissionAdmin)
-                self.submissions_registered[form.model] = True
-                
-                if form.item_model:
-                    self.register(form.item_model, SubmissionItemAdmin)
-                    self.submissions_registered[form.item_model] = True
+                self.register_form_models(form)
         
         form_published_changed.send(self)
     
@@ -60,7 +73,11 @@ class FormativeAdminSite(admin.AdminSite):
         url = path('files_download/<int:form_id>/',
                    self.admin_view(download_view),
                    name='formative_files_download')
-        return [url] + urls
+        export_url = path('files_export/<uuid:export_id>/',
+                          self.admin_view(partial(export_view,
+                                                  admin_site=self)),
+                          name='formative_files_export')
+        return [url, export_url] + urls
 
 
 site = FormativeAdminSite()
@@ -550,7 +567,9 @@ class FormBlockBase:
         # this will hide add button when we don't have the form_id
         if match and match.url_name == f'{app_label}_formblock_changelist':
             return False
-        # or when the form is not a draft
+        # or when the form is not a draft. blocks can't yet be added to a
+        # published form: update_model would add their columns, but not
+        # their labels, dependencies or stock block fields
         pages = (f'{app_label}_formblock_{n}' for n in ('formlist', 'change'))
         if match and match.url_name in pages:
             form = self.try_form_id(request, match)
@@ -767,11 +786,15 @@ class CustomBlockAdmin(FormBlockChildAdmin, DynamicArrayMixin):
         
         if obj: fields += ('type',)
         if obj and obj.form.status != Form.Status.DRAFT:
-            if obj.type == CustomBlock.InputType.TEXT:
-                fields += ('num_lines', 'max_chars')
-            elif obj.type == CustomBlock.InputType.CHOICE:
+            if obj.type == CustomBlock.InputType.CHOICE:
                 fields += ('choices',)
         return fields
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # text length options can change the published form's table
+        if change and obj.form.status != Form.Status.DRAFT:
+            obj.form.update_model()
 
 
 @admin.register(CollectionBlock, site=site)
@@ -836,10 +859,13 @@ class SuperuserAccessMixin:
 class SiteAccessMixin:
     def has_change_permission(self, request, obj=None):
         slug = self.model._meta.program_slug
-        site = get_current_site(request)
-        
-        programs = user_programs(site.programs, '', request)
-        return slug in programs.values_list('db_slug', flat=True)
+        if not hasattr(request, '_program_slugs'):
+            # checked for every submission model and row, once per request
+            site = get_current_site(request)
+            programs = user_programs(site.programs, '', request)
+            request._program_slugs = set(programs.values_list('db_slug',
+                                                              flat=True))
+        return slug in request._program_slugs
     
     def has_view_permission(self, request, obj=None):
         return self.has_change_permission(request, obj)
@@ -861,6 +887,76 @@ class SubmittedListFilter(admin.SimpleListFilter):
         if self.value() == 'no': return queryset.filter(_submitted=None)
 
 
+class EstimatedCountPaginator(Paginator):
+    # an exact count of a large table is a full scan on every page load, so
+    # unfiltered listings show the estimate once there are enough rows
+    estimate_over = 10000
+    
+    def __init__(self, *args, keyset=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the last filter only continues after an earlier page's rows
+        self.keyset = keyset
+    
+    @cached_property
+    def count(self):
+        # which doesn't count as filtering
+        if len(self.object_list.query.where.children) <= self.keyset:
+            estimate = estimated_count(self.object_list.model)
+            if estimate > self.estimate_over: return estimate
+        return super().count
+
+
+class SubmissionChangeList(ChangeList):
+    after_var = 'after'
+    
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(self.after_var, None)
+        return params
+    
+    @property
+    def after(self):
+        return self.params.get(self.after_var)
+    
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if not self.after: return qs
+        
+        # rows after (_created, _id) in the default order. _created alone
+        # would skip the rest of the rows sharing the last one's timestamp
+        created, _, pk = self.after.partition(',')
+        try:
+            created, pk = parse_datetime(created), uuid.UUID(pk)
+        except ValueError as e: raise IncorrectLookupParameters(e)
+        if not created: raise IncorrectLookupParameters(self.after_var)
+        return qs.filter(Q(_created__lt=created) |
+                         Q(_created=created, _id__lt=pk))
+    
+    def get_results(self, request):
+        super().get_results(request)
+        
+        item_model = self.model_admin.registered_item_model()
+        if item_model:
+            # items of the page's rows counted in one query, not one per row
+            ids = [ obj.pk for obj in self.result_list ]
+            items = item_model.objects.filter(_submission__in=ids)
+            counts = dict(items.order_by().values_list('_submission')
+                          .annotate(count=Count('*')))
+            for obj in self.result_list: obj._items_count = counts.get(obj.pk)
+        
+        # in the default order, the next page is reached by keyset instead,
+        # continuing after the last row shown rather than at an offset
+        self.keyset_url = None
+        order = self.queryset.query.order_by
+        if order[:2] != ('-_created', '-_id') or not self.result_list: return
+        if len(self.result_list) < self.list_per_page: return
+        
+        last = self.result_list[len(self.result_list) - 1]
+        self.keyset_url = self.get_query_string({
+            self.after_var: f'{last._created.isoformat()},{last._id}'
+        }, [PAGE_VAR])
+
+
 class SubmissionRecordFormSet(forms.BaseModelFormSet):
     @classmethod
     def get_default_prefix(cls): return 'formative-submissionrecord'
@@ -885,11 +981,34 @@ class SubmissionRecordInline(admin.TabularInline):
 class SubmissionAdmin(SiteAccessMixin, SubmissionActionsMixin,
                       admin.ModelAdmin):
     list_display = ('_email', '_created', '_modified', '_submitted')
-    list_filter = ('_email', SubmittedListFilter)
+    list_filter = (SubmittedListFilter,)
+    search_fields = ('_email',)
     readonly_fields = ('_submitted', 'items_index',)
+    ordering = ('-_created', '-_id')
     form = SubmissionAdminForm
     inlines = [SubmissionRecordInline]
     actions = ['send_email', 'export_csv', 'download_files']
+    change_list_template = 'admin/formative/submission/change_list.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_changelist(self, request, **kwargs):
+        return SubmissionChangeList
+    
+    def get_paginator(self, request, queryset, per_page, **kwargs):
+        keyset = SubmissionChangeList.after_var in request.GET
+        return self.paginator(queryset, per_page, keyset=keyset, **kwargs)
+    
+    def registered_item_model(self):
+        # registered alongside, saving a form lookup just to find it
+        for models in self.admin_site.submissions_registered.values():
+            if models[0] is self.model: return (models[1:] or [None])[0]
+        return None
+    
+    def get_list_display(self, request):
+        display = super().get_list_display(request)
+        if not self.registered_item_model(): return display
+        return display + ('items_count',)
     
     def get_actions(self, request):
         actions = super().get_actions(request)
@@ -916,17 +1035,26 @@ class SubmissionAdmin(SiteAccessMixin, SubmissionActionsMixin,
         args['queryset'] = SubmissionRecord.objects.filter(submission=obj.pk)
         return args
     
-    @admin.display(description='items')
-    def items_index(self, obj):
+    def items_url(self, obj):
         app, name = self.model._meta.app_label, self.model._meta.model_name
         args = f'?_submission___id__exact={obj._id}'
         try:
-            url = reverse('admin:%s_%s_changelist' % (app, name + '_i'),
-                          current_app=self.admin_site.name) + args
-        except NoReverseMatch: return ''
-        
+            return reverse('admin:%s_%s_changelist' % (app, name + '_i'),
+                           current_app=self.admin_site.name) + args
+        except NoReverseMatch: return None
+    
+    @admin.display(description='items')
+    def items_index(self, obj):
+        url = self.items_url(obj)
+        if not url: return ''
         return mark_safe(f'<a href="{url}">items listing</a>')
     
+    @admin.display(description='items')
+    def items_count(self, obj):
+        url = self.items_url(obj)
+        if not url or not obj._items_count: return obj._items_count or 0
+        return format_html('<a href="{}">{}</a>', url, obj._items_count)
+    
     def view_on_site(self, obj):
         url = obj._get_absolute_url()
         if obj._submitted: url += 'review'
@@ -947,6 +1075,78 @@ class SubmissionItemAdmin(SiteAccessMixin, admin.ModelAdmin):
         return False
 
 
+class ProgramRecordAdmin(admin.ModelAdmin):
+    # read-only records of background work, for the programs of the site
+    program_path = 'program__'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        site, path = get_current_site(request), self.program_path
+        queryset = queryset.filter(**{path+'sites': site})
+        return user_programs(queryset, path, request)
+
+
+@admin.register(EmailCampaign, site=site)
+class EmailCampaignAdmin(ProgramRecordAdmin):
+    list_display = ('created', 'form', 'subject', 'sent_count',
+                    'failed_count', 'unsent_count', 'completed')
+    list_filter = ('program',)
+    
+    def get_queryset(self, request):
+        Status, n = EmailRecipient.Status, 'recipients'
+        counts = { f'{name}_{n}': Count(n, filter=Q(**{f'{n}__status__in':
+                                                       statuses}))
+                   for name, statuses in (
+                       ('sent', [Status.SENT]), ('failed', [Status.FAILED]),
+                       ('unsent', [Status.PENDING, Status.SENDING])
+                   ) }
+        return super().get_queryset(request).annotate(**counts)
+    
+    def recipients_link(self, obj, status, n):
+        url = reverse('admin:formative_emailrecipient_changelist',
+                      current_app=self.admin_site.name)
+        url += f'?campaign__id__exact={obj.pk}&status__exact={status}'
+        return format_html('<a href="{}">{}</a>', url, n)
+    
+    @admin.display(description='sent')
+    def sent_count(self, obj):
+        return obj.sent_recipients
+    
+    @admin.display(description='failed')
+    def failed_count(self, obj):
+        if not obj.failed_recipients: return 0
+        return self.recipients_link(obj, EmailRecipient.Status.FAILED,
+                                    obj.failed_recipients)
+    
+    @admin.display(description='not sent yet')
+    def unsent_count(self, obj):
+        return obj.unsent_recipients
+
+
+@admin.register(EmailRecipient, site=site)
+class EmailRecipientAdmin(ProgramRecordAdmin):
+    program_path = 'campaign__program__'
+    list_display = ('submission', 'campaign', 'status', 'sent', 'error')
+    list_filter = ('status',)
+    search_fields = ('submission',)
+    list_select_related = ('campaign',)
+
+
+@admin.register(OutboxEmail, site=site)
+class OutboxEmailAdmin(ProgramRecordAdmin):
+    list_display = ('created', 'name', 'form', 'submission', 'sent', 'failed',
+                    'attempts', 'error')
+    list_filter = (('sent', admin.EmptyFieldListFilter),
+                   ('failed', admin.EmptyFieldListFilter), 'name')
+    search_fields = ('submission',)
+
+
 @admin.register(Site, site=site)
 class SiteAdmin(SuperuserAccessMixin, admin.ModelAdmin):
     form = SiteAdminForm
@@ -960,8 +1160,8 @@ class SiteAdmin(SuperuserAccessMixin, admin.ModelAdmin):
     
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        Site.objects.clear_cache()
+        clear_site_cache()
     
     def delete_model(self, request, obj):
         super().delete_model(request, obj)
-        Site.objects.clear_cache()
+        clear_site_cache()
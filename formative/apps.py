@@ -26,3 +26,5 @@ class FormativeConfig(AppConfig):
             
     def ready(self):
         from . import signals
+        from .plugins import populate_plugin_index
+        populate_plugin_index()
@@ -9,6 +9,7 @@ class FileType:
     types = {}
     extensions = {}
     composite = False
+    compressed = False # already-compressed formats are stored as-is in ZIPs
     logger = logging.getLogger('django.request')
     
     def __init_subclass__(cls, **kwargs):
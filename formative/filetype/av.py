@@ -8,6 +8,7 @@ from . import FileType
 
 class AVFileType(FileType):
     TYPE = None
+    compressed = True
     
     def meta(self, path):
         ret = super().meta(path)
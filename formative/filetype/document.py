@@ -7,6 +7,7 @@ from . import FileType
 class DocumentFile(FileType):
     TYPE = 'document'
     EXTENSIONS = ('pdf',)
+    compressed = True
     
     def meta(self, path):
         ret = super().meta(path)
@@ -11,6 +11,7 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 class ImageFile(FileType):
     TYPE = 'image'
     EXTENSIONS = ('jpg', 'jpeg', 'gif', 'png')
+    compressed = True
     
     def meta(self, path):
         ret = super().meta(path)
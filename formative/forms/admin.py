@@ -17,7 +17,7 @@ from ..models import Program, Form, FormBlock, CustomBlock, CollectionBlock, \
 from ..plugins import get_available_plugins
 from ..validators import validate_program_identifier, validate_form_identifier,\
     validate_formblock_identifier
-from ..utils import any_name_field
+from ..utils import any_name_field, pyarrow
 
 
 class NullWidget(forms.Widget):
@@ -406,10 +406,27 @@ class FormAdminForm(AdminJSONForm):
                   'Default is 5.'
     )
     no_review_after_submit = forms.BooleanField(required=False)
+    partitioned = forms.BooleanField(
+        required=False, label='partition drafts',
+        help_text='Store drafts and submitted entries in separate partitions, '
+                  'for forms with many abandoned drafts. An email address '
+                  'is then unique among drafts and among submitted entries. '
+                  'Cannot be changed after publishing.'
+    )
     thanks = forms.CharField(
         required=False, widget=widgets.AdminTextareaWidget(attrs={'rows': 5}),
         label='thanks page text'
     )
+    draft_retention_days = forms.IntegerField(
+        required=False, min_value=1, widget=widgets.AdminIntegerFieldWidget,
+        help_text="Drafts that haven't been modified for this many days are "
+                  "deleted, with their files, by a nightly job. "
+                  "Leave empty to keep drafts."
+    )
+    archive_drafts = forms.BooleanField(
+        required=False,
+        help_text='Keep a copy of the deleted drafts in an archive file.'
+    )
     email_names = forms.CharField(
         required=False, label='custom email names',
         help_text='If you want to define custom emails, enter a '
@@ -422,7 +439,8 @@ class FormAdminForm(AdminJSONForm):
             'hidden', 'enabled_message', 'disabled_message',
             'completed_message', 'access_enable', 'review_pre', 'review_post',
             'submitted_review_pre', 'timed_completion', 'complete_submit_time',
-            'no_review_after_submit', 'thanks', 'emails'
+            'no_review_after_submit', 'partitioned', 'thanks',
+            'draft_retention_days', 'archive_drafts', 'emails'
         ]}
         dynamic_fields = True
     
@@ -440,13 +458,15 @@ class FormAdminForm(AdminJSONForm):
         
         if program_form and program_form.status != Form.Status.DRAFT:
             self.fields['status'].choices = self.fields['status'].choices[1:]
+            self.fields['partitioned'].disabled = True
         
         if not program_form:
             del self.fields['status']
             for n in ('access_enable', 'review_pre', 'review_post', 'thanks',
                       'submitted_review_pre', 'timed_completion',
                       'complete_submit_time', 'no_review_after_submit',
-                      'email_names'):
+                      'partitioned', 'draft_retention_days',
+                      'archive_drafts', 'email_names'):
                 del self.fields[n]
         else:
             custom_emails = {}
@@ -636,6 +656,21 @@ class CustomBlockAdminForm(FormBlockAdminForm, AdminJSONForm):
                     if field > self.instance.numeric_max():
                         self.add_error('default_value',
                                        "Can't be more than the maximum value")
+        
+        block = self.instance
+        if block.pk and block.type == CustomBlock.InputType.TEXT \
+           and block.form.status != Form.Status.DRAFT:
+            # a published form's column can be widened in place, not narrowed
+            new_block = deepcopy(block)
+            for name in ('num_lines', 'max_chars', 'min_chars', 'min_words'):
+                if name in cleaned_data: setattr(new_block, name,
+                                                 cleaned_data[name])
+            field, new_field = block.field(), new_block.field()
+            if new_field.get_internal_type() == 'CharField':
+                if field.get_internal_type() != 'CharField' \
+                   or new_field.max_length < field.max_length:
+                    self.add_error('max_chars', "Can't be reduced after the "
+                                                "form has been published.")
         return cleaned_data
 
 
@@ -864,19 +899,34 @@ class ExportAdminForm(forms.Form):
                 self.fields[f'cfield_{block.name}._file'] = forms.BooleanField(
                     label='file URL', required=False
                 )
+        
+        if pyarrow:
+            choices = [('csv', 'CSV'), ('parquet', 'Parquet (typed columns)'),
+                       ('arrow', 'Arrow IPC (typed columns)')]
+            self.fields['format'] = forms.ChoiceField(choices=choices,
+                                                      initial='csv')
 
 
 class MoveBlocksAdminForm(forms.Form):
-    page = forms.ChoiceField(
-        choices=(), widget=forms.Select(attrs={'style': 'padding: 4px'})
+    page = forms.TypedChoiceField(
+        choices=(), coerce=int,
+        widget=forms.Select(attrs={'style': 'padding: 4px'})
     )
     
-    def __init__(self, max_page, min_page=1, new_page=True, *args, **kwargs):
+    def __init__(self, max_page, min_page=1, new_page=True, from_pages=(),
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         choices = [ (n, f'{n}') for n in range(min_page, max_page + 1) ]
         if new_page: choices.append((max_page + 1, f'{max_page+1} (new)'))
         self.fields['page'].choices = choices
+        self.from_pages = set(from_pages)
+    
+    def clean(self):
+        if len(self.from_pages) > 1:
+            raise ValidationError('Blocks can only be moved from one page '
+                                  'at a time. Select blocks on the same page.')
+        return super().clean()
 
 
 class FormPluginsAdminForm(forms.Form):
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...models import Form
+from ...utils import add_missing_indexes
+
+
+class Command(BaseCommand):
+    help = 'Add missing indexes to submission and item tables of published ' \
+           'forms, without locking them against writes.'
+    
+    def handle(self, *args, **options):
+        forms = Form.objects.exclude(status=Form.Status.DRAFT)
+        for form in forms.select_related('program'):
+            for model in (form.model, form.item_model):
+                if not model: continue
+                
+                with connection.schema_editor(atomic=False) as editor:
+                    added = add_missing_indexes(model, editor)
+                for name in added:
+                    self.stdout.write(f'{model._meta.db_table}: added {name}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Form
+
+
+class Command(BaseCommand):
+    help = "Alter published forms' tables in place to match their blocks."
+    
+    def add_arguments(self, parser):
+        parser.add_argument('form_ids', nargs='*', type=int)
+    
+    def handle(self, *args, **options):
+        forms = Form.objects.exclude(status=Form.Status.DRAFT)
+        if options['form_ids']: forms = forms.filter(id__in=options['form_ids'])
+        
+        for form in forms.select_related('program'):
+            if form.update_model(): self.stdout.write(f'{form}: updated')
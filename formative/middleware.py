@@ -2,46 +2,79 @@ from django import urls
 from django.core.cache import cache
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-import sys, importlib, zoneinfo
+import sys, importlib, functools, zoneinfo
 
 from .admin import site
-from .models import Site
+from .models import Form, Site
 from .utils import get_current_site
 
 
 class DynamicModelMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
-        self.models_version = 0
+        self.models_version, self.form_versions = 0, {}
     
     def __call__(self, request):
-        version = cache.get('models_version') or 0
+        # models_version changes on publish, a form's own on table updates
+        keys = { f'models_version_{id}': id
+                 for id in site.submissions_registered or {} }
+        versions = cache.get_many(['models_version', *keys])
+        version = versions.get('models_version') or 0
         
         if version > self.models_version or site.submissions_registered is None:
             self.models_version = version
             
             site.register_submission_models()
-            ContentType.objects.clear_cache()
-            # unlike normal Django, we might have had changes to the admin urls
-            urls.clear_url_caches()
-            if 'urls' in sys.modules: importlib.reload(sys.modules['urls'])
+            keys = { f'models_version_{id}': id
+                     for id in site.submissions_registered }
+            versions = cache.get_many(keys)
+            self.form_versions = { id: versions.get(key) or 0
+                                   for key, id in keys.items() }
+        else:
+            changed = False
+            for key, id in keys.items():
+                form_version = versions.get(key) or 0
+                if form_version <= self.form_versions.get(id, 0): continue
+                
+                self.form_versions[id] = form_version
+                site.register_form_models(Form.objects.get(id=id))
+                changed = True
+            if not changed: return self.get_response(request)
+        
+        ContentType.objects.clear_cache()
+        # unlike normal Django, we might have had changes to the admin urls
+        urls.clear_url_caches()
+        if 'urls' in sys.modules: importlib.reload(sys.modules['urls'])
         
         return self.get_response(request)
 
 
+@functools.lru_cache(maxsize=None)
+def site_zoneinfo(time_zone):
+    return zoneinfo.ZoneInfo(time_zone)
+
+
 class SitesMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        self.sites_version = 0
     
     def __call__(self, request):
+        # a site changed in another process is seen here by the next request
+        version = cache.get('sites_version') or 0
+        if version != self.sites_version:
+            self.sites_version = version
+            Site.objects.clear_cache()
+        
         site = get_current_site(request)
-        if site and site.time_zone:
-            timezone.activate(zoneinfo.ZoneInfo(site.time_zone))
-        else:
-            timezone.deactivate()
-            if not site: # Django expects a site obj if contrib.sites installed
-                # any request domain that we see here has been set up by admin
-                Site(domain=request.get_host(), name='Formative').save()
-                Site.objects.clear_cache()
+        if not site: # Django expects a site obj if contrib.sites installed
+            # any request domain that we see here has been set up by admin.
+            # it's cached by the next request's lookup
+            site, _ = Site.objects.get_or_create(domain=request.get_host(),
+                                                 defaults={'name': 'Formative'})
+            request.site = site
+        
+        if site.time_zone: timezone.activate(site_zoneinfo(site.time_zone))
+        else: timezone.deactivate()
         
         return self.get_response(request)
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.10 on 2026-10-19 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formative', '0010_alter_user_options_user_site_user_uniq_site_email_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilesExport',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('form', models.SlugField(allow_unicode=True, max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('size', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('program', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='formative.program')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
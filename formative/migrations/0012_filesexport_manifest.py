@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-19 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formative', '0011_filesexport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesexport',
+            name='manifest',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.0.10 on 2026-10-19 09:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formative', '0012_filesexport_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailCampaign',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('form', models.SlugField(allow_unicode=True, max_length=64)),
+                ('subject', models.TextField()),
+                ('content', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('program', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='formative.program')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EmailRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission', models.UUIDField()),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=16)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='formative.emailcampaign')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='emailrecipient',
+            index=models.Index(fields=['campaign', 'status'], name='formative_e_campaig_2ea9a2_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='emailrecipient',
+            constraint=models.UniqueConstraint(fields=('campaign', 'submission'), name='unique_campaign_submission'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.apps.registry import Apps
+from django.db import migrations, models
+
+from formative.utils import create_model, add_missing_indexes
+
+def submission_models(apps, db_index):
+    # submission tables published before _submitted and _modified had indexes
+    Form = apps.get_model('formative', 'Form')
+    for form in Form.objects.exclude(status='draft').select_related('program'):
+        class Meta:
+            apps = Apps()
+        name = form.program.db_slug + '_' + form.db_slug
+        fields = {
+            '_submitted': models.DateTimeField(null=True, blank=True,
+                                               db_index=db_index),
+            '_modified': models.DateTimeField(auto_now=True, db_index=db_index)
+        }
+        yield create_model(name, fields.items(), meta=Meta), fields
+
+def add_indexes(apps, schema_editor):
+    # built concurrently, so live tables can still be written to
+    for model, _ in submission_models(apps, True):
+        add_missing_indexes(model, schema_editor)
+
+def remove_indexes(apps, schema_editor):
+    for model, fields in submission_models(apps, False):
+        for field in fields.values():
+            new_field = field.clone()
+            new_field.set_attributes_from_name(field.name)
+            field.db_index = True
+            schema_editor.alter_field(model, field, new_field)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('formative', '0014_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes)
+    ]
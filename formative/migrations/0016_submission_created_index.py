@@ -0,0 +1,38 @@
+from django.apps.registry import Apps
+from django.db import migrations, models
+
+from formative.utils import create_model, add_missing_indexes
+
+def submission_models(apps, db_index):
+    # the admin lists submissions newest first, paging by _created
+    Form = apps.get_model('formative', 'Form')
+    for form in Form.objects.exclude(status='draft').select_related('program'):
+        class Meta:
+            apps = Apps()
+        name = form.program.db_slug + '_' + form.db_slug
+        field = models.DateTimeField(auto_now_add=True, db_index=db_index)
+        yield create_model(name, [('_created', field)], meta=Meta), field
+
+def add_index(apps, schema_editor):
+    # built concurrently, so live tables can still be written to
+    for model, _ in submission_models(apps, True):
+        add_missing_indexes(model, schema_editor)
+
+def remove_index(apps, schema_editor):
+    for model, field in submission_models(apps, False):
+        new_field = field.clone()
+        new_field.set_attributes_from_name('_created')
+        field.db_index = True
+        schema_editor.alter_field(model, field, new_field)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('formative', '0015_submission_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index)
+    ]
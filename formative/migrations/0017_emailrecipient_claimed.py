@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-19 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formative', '0016_submission_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailrecipient',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='emailrecipient',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=16),
+        ),
+    ]
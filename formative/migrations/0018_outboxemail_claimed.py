@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-19 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formative', '0017_emailrecipient_claimed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxemail',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outboxemail',
+            name='failed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,11 @@
-from django.db import models, connection
-from django.db.models import Q, Max, Case, Value, When, Exists, OuterRef, \
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import Q, F, Max, Case, Value, When, Exists, OuterRef, \
     UniqueConstraint, Subquery
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.core.exceptions import FieldError, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.template import Template, loader
 from django.utils.functional import cached_property
 from django.utils.html import escape
@@ -14,7 +15,7 @@ from django.utils import timezone
 from django.urls import reverse
 from polymorphic.models import PolymorphicModel
 from polymorphic.managers import PolymorphicManager
-import uuid
+import uuid, hashlib, gzip, json
 from itertools import groupby
 from pathlib import Path
 from datetime import timedelta
@@ -23,13 +24,17 @@ import os
 from ..stock import StockWidget
 from ..filetype import FileType
 from ..utils import create_model, remove_p, send_email, submission_link, \
-    thumbnail_path, MarkdownFormatter
+    thumbnail_path, remove_submission_dirs, add_missing_indexes, \
+    MarkdownFormatter
 from .ranked import RankedModel, UnderscoredRankedModel
 from .automatic import AutoSlugModel
 
 
 markdown = MarkdownFormatter()
 
+# form's emails: (form id, email name) -> (source hash, subject, content)
+compiled_emails = {}
+
 
 class ProgramManager(models.Manager):
     def get_by_natural_key(self, slug):
@@ -161,11 +166,14 @@ class Form(AutoSlugModel):
             for field in c.collection_fields():
                 if field not in names: names.append(field)
         
+        partitioned = self.partitioned()
         fields = [
             # the first column links submission items to the submission
             ('_submission', models.ForeignKey(self.model, models.CASCADE,
                                               related_name='_items',
-                                              related_query_name='_item'))
+                                              related_query_name='_item',
+                                              # no unique key on partitioned
+                                              db_constraint=not partitioned))
         ]
         
         field_blocks = { b.name: b for b in self.collection_field_blocks() }
@@ -177,28 +185,114 @@ class Form(AutoSlugModel):
             fields.append((n, block.field()))
         
         name = self.program.db_slug + '_' + self.db_slug + '_i'
+        prefix = self.program.db_slug + '_' + self.db_slug
         class Meta:
             constraints = [
                 UniqueConstraint(
                     fields=['_submission', '_collection', '_block', '_rank'],
-                    name=self.program.db_slug+'_'+self.db_slug+'_u'
+                    name=prefix+'_u'
                 )
             ]
+            indexes = [
+                # a submission's items for a block, and its uploads in progress
+                models.Index(fields=['_submission', '_block'],
+                             name=prefix+'_b'),
+                models.Index(fields=['_submission', '_block'],
+                             name=prefix+'_p',
+                             condition=Q(_file='', _filesize__gt=0)),
+                # items with files, for downloads and exports
+                models.Index(fields=['_submission'], name=prefix+'_f',
+                             condition=~Q(_file=''))
+            ]
             verbose_name = self.slug + ' item'
             verbose_name_plural = self.slug + ' items'
         return create_model(name, fields, program=self.program.db_slug,
                             base_class=SubmissionItem, meta=Meta)
     
-    def cache_dirty(self):
-        version = cache.get('models_version')
-        if version is None: cache.set('models_version', 1, timeout=None)
-        else: cache.incr('models_version')
+    def cache_dirty(self, form_only=False):
+        key = form_only and f'models_version_{self.id}' or 'models_version'
+        version = cache.get(key)
+        if version is None: cache.set(key, 1, timeout=None)
+        else: cache.incr(key)
+    
+    def update_table(self, model):
+        # alter the live table in place, to match the model's current fields
+        table, introspection = model._meta.db_table, connection.introspection
+        with connection.cursor() as cursor:
+            columns = { c.name: c for c in
+                        introspection.get_table_description(cursor, table) }
+            constraints = introspection.get_constraints(cursor, table)
+        
+        changed = False
+        with connection.schema_editor() as editor:
+            for field in model._meta.local_concrete_fields:
+                if field.column not in columns:
+                    editor.add_field(model, field)
+                    changed = True
+                    continue
+                
+                column = columns.pop(field.column)
+                field_type = introspection.get_field_type(column.type_code,
+                                                          column)
+                # the column's existing constraints and indexes, which
+                # alter_field would otherwise try to create a second time
+                single = [ c for c in constraints.values()
+                           if c['columns'] == [field.column]
+                           and not c['primary_key'] ]
+                params = {'null': column.null_ok,
+                          'unique': any(c['unique'] for c in single),
+                          'db_index': any(c['index'] and not c['unique']
+                                          for c in single)}
+                if field_type == 'CharField':
+                    params['max_length'] = column.internal_size
+                old_field = getattr(models, field_type)(**params)
+                old_field.set_attributes_from_name(field.name)
+                old_field.column = field.column
+                old_field.model = model
+                
+                if old_field.db_type(connection) == field.db_type(connection) \
+                   and old_field.null == field.null: continue
+                editor.alter_field(model, old_field, field)
+                changed = True
+            
+            # columns of removed fields keep their data, but mustn't block
+            for column in columns.values():
+                if column.null_ok: continue
+                editor.execute(editor.sql_alter_column % {
+                    'table': editor.quote_name(table),
+                    'changes': editor.sql_alter_column_null % {
+                        'column': editor.quote_name(column.name)
+                    }
+                })
+                changed = True
+        return changed
+    
+    def update_model(self):
+        if self.status == self.Status.DRAFT: return False
+        
+        if 'model' in self.__dict__: del self.model
+        if 'item_model' in self.__dict__: del self.item_model
+        
+        changed = self.update_table(self.model)
+        if self.item_model:
+            tables = connection.introspection.table_names()
+            if self.item_model._meta.db_table not in tables:
+                from ..admin import SubmissionItemAdmin
+                self.publish_model(self.item_model, admin=SubmissionItemAdmin)
+                return True
+            changed = self.update_table(self.item_model) or changed
+        
+        # only this form's submission models need to be reloaded
+        if changed: self.cache_dirty(form_only=True)
+        return changed
     
     def publish_model(self, model, admin=None):
         from ..signals import all_forms_publish
         
         with connection.schema_editor() as editor:
             editor.create_model(model)
+            if model is self.model and self.partitioned():
+                self.partition_table(editor, model)
         ctype = ContentType(app_label=model._meta.app_label,
                             model=model.__name__)
         ctype.save()
@@ -207,6 +301,38 @@ class Form(AutoSlugModel):
         all_forms_publish.send(self, content_type=ctype)
         self.cache_dirty()
     
+    def partition_table(self, editor, model):
+        # drafts and submitted rows are kept in separate partitions. the table
+        # created by Django becomes the submitted partition, and its unique
+        # constraints (and the primary key) are enforced within each partition
+        table = model._meta.db_table
+        # Django's own indexes go on the table now, before it's renamed, rather
+        # than on the parent when the schema editor exits
+        for sql in editor.deferred_sql: editor.execute(sql)
+        editor.deferred_sql = []
+        for index in model._meta.indexes:
+            editor.execute('ALTER INDEX %s RENAME TO %s' % (
+                editor.quote_name(index.name),
+                editor.quote_name(index.name + '_s')
+            ))
+        
+        names = { 'table': editor.quote_name(table),
+                  'submitted': editor.quote_name(table + '_s'),
+                  'drafts': editor.quote_name(table + '_d') }
+        for sql in (
+            'ALTER TABLE {table} RENAME TO {submitted}',
+            'CREATE TABLE {table} (LIKE {submitted} INCLUDING DEFAULTS) '
+            'PARTITION BY LIST ((_submitted IS NULL))',
+            'ALTER TABLE {table} ATTACH PARTITION {submitted} '
+            'FOR VALUES IN (false)',
+            'CREATE TABLE {drafts} (LIKE {submitted} INCLUDING ALL)',
+            'ALTER TABLE {table} ATTACH PARTITION {drafts} FOR VALUES IN (true)'
+        ): editor.execute(sql.format(**names))
+        
+        # the model's indexes are partitioned indexes of the parent, with the
+        # partitions' copies attached, so that indexes added later cascade
+        add_missing_indexes(model, editor, concurrently=False)
+    
     def unpublish_model(self, model):
         from ..signals import all_forms_unpublish
         
@@ -271,6 +397,7 @@ class Form(AutoSlugModel):
         
         if 'plugins' not in self.options: self.options['plugins'] = []
         self.options['plugins'] += plugins
+        self.__dict__.pop('_all_plugins', None)
     
     def remove_plugins(self, plugins):
         available = self.get_available_plugins()
@@ -282,6 +409,7 @@ class Form(AutoSlugModel):
 
         new_plugins = [ p for p in enabled if p not in plugins ]
         self.options['plugins'] = new_plugins
+        self.__dict__.pop('_all_plugins', None)
     
     def default_text_label_style(self):
         if 'default_text_label_style' in self.options:
@@ -309,6 +437,33 @@ class Form(AutoSlugModel):
     def validation_block(self):
         return self.blocks.get(page=0, _rank=1)
     
+    def move_blocks(self, block_ids, page, from_page):
+        # the blocks go to the end of the new page, in order, and the ones
+        # left behind close up. rather than moving them one save at a time,
+        # both pages are locked, then renumbered by two updates
+        blocks = FormBlock.objects.non_polymorphic().filter(form=self)
+        with transaction.atomic():
+            locked = blocks.filter(page__in=(from_page, page))
+            ranks = list(locked.order_by('page', '_rank').select_for_update()
+                         .values_list('id', 'page', '_rank'))
+            
+            block_ids = set(block_ids)
+            source = [ i for i, p, _ in ranks if p == from_page ]
+            moving = [ i for i in source if i in block_ids ]
+            if not moving or page == from_page: return 0
+            
+            end = max([ r for _, p, r in ranks if p == page ], default=0)
+            staying = [ i for i in source if i not in block_ids ]
+            updates = [ FormBlock(id=i, page=from_page, _rank=n)
+                        for n, i in enumerate(staying, 1) ]
+            updates += [ FormBlock(id=i, page=page, _rank=end+n)
+                         for n, i in enumerate(moving, 1) ]
+            
+            # negatives are the temporary space that avoids rank conflicts
+            blocks.filter(page=from_page).update(_rank=-F('_rank'))
+            FormBlock.objects.bulk_update(updates, ['page', '_rank'])
+        return len(moving)
+    
     def visible_blocks(self, page=None, skip=None):
         query = self.blocks.all()
         if skip: query = query.exclude(id__in=skip)
@@ -316,6 +471,17 @@ class Form(AutoSlugModel):
         else: return query.exclude(page=0, _rank__gt=0)
         return query.filter(page__gt=0)
     
+    def email_context_blocks(self):
+        # names of visible blocks, with the field names of any stock widgets
+        blocks = []
+        for block in self.visible_blocks():
+            if block.block_type() == 'custom': blocks.append((block.name, None))
+            elif block.block_type() == 'stock':
+                fields = { n: block.stock.field_name(n)
+                           for n in block.stock.widget_names() }
+                blocks.append((block.name, fields))
+        return blocks
+    
     def visible_items(self, submission, page=None, skip=None):
         if not self.item_model: return []
         
@@ -368,6 +534,116 @@ class Form(AutoSlugModel):
         if 'access_enable' in self.options: return self.options['access_enable']
         return None
     
+    def partitioned(self):
+        return 'partitioned' in self.options
+    
+    def draft_retention_days(self):
+        if 'draft_retention_days' in self.options:
+            return self.options['draft_retention_days']
+        return None
+    
+    def expire_drafts(self, batch_size=500):
+        # drafts not modified within the retention period are removed in
+        # batches, optionally archived first. their files go after each commit
+        days = self.draft_retention_days()
+        if not days or self.status == self.Status.DRAFT: return 0
+        
+        modified = timezone.now() - timedelta(days=days)
+        stale = self.model.objects.filter(_submitted=None,
+                                          _modified__lt=modified)
+        archive = 'archive_drafts' in self.options and self.archive_path()
+        if archive: os.makedirs(os.path.dirname(archive), exist_ok=True)
+        
+        n = 0
+        while (ids := list(stale.values_list('_id', flat=True)[:batch_size])):
+            with transaction.atomic():
+                # locked and checked again, as a draft may have been saved or
+                # submitted since it was selected
+                locked = stale.filter(_id__in=ids).select_for_update()
+                ids = list(locked.values_list('_id', flat=True))
+                submissions = self.model.objects.filter(_id__in=ids)
+                items = None
+                if self.item_model:
+                    items = self.item_model.objects.filter(_submission__in=ids)
+                if archive: self.archive_drafts(archive, submissions, items)
+                
+                if items is not None: items.delete()
+                submissions.delete()
+                SubmissionRecord.objects.filter(
+                    submission__in=ids, type=SubmissionRecord.RecordType.FILES
+                ).update(deleted=True)
+            
+            remove_submission_dirs(ids)
+            n += len(ids)
+        return n
+    
+    def files_records(self, target=None):
+        # FILES records not yet purged: all, those of drafts, or of deleted
+        sr = SubmissionRecord.objects.all()
+        qs = sr.filter(program=self.program, form=self.slug, deleted=False,
+                       type=SubmissionRecord.RecordType.FILES)
+        q1 = self.model.objects.filter(_id=OuterRef('submission'))
+        q2 = sr.filter(submission=OuterRef('submission'), deleted=False,
+                       type=SubmissionRecord.RecordType.SUBMISSION)
+        if target == 'draft': qs = qs.exclude(Exists(q2)).filter(Exists(q1))
+        elif target == 'deleted': qs = qs.exclude(Exists(q1))
+        return qs
+    
+    def files_purge_key(self):
+        return f'files_purge_{self.id}'
+    
+    def files_purge_progress(self):
+        return cache.get(self.files_purge_key())
+    
+    def purge_files(self, target=None, chunk_size=None):
+        # records are marked deleted chunk by chunk, so that a purge that was
+        # interrupted picks up where it stopped. progress is kept in the cache
+        if not chunk_size: chunk_size = settings.FILES_PURGE_CHUNK_SIZE
+        key, timeout = self.files_purge_key(), settings.FILES_PURGE_TIMEOUT
+        progress = cache.get(key) or {'target': target, 'done': 0, 'last': 0}
+        qs = self.files_records(target).order_by('id')
+        
+        # records that are kept aren't marked, so they're skipped over by id
+        progress['total'] = progress['done'] + \
+                            qs.filter(id__gt=progress['last']).count()
+        cache.set(key, progress, timeout=timeout)
+        
+        while (recs := list(qs.filter(id__gt=progress['last'])
+                              .values_list('id', 'submission')[:chunk_size])):
+            submissions = { sub for _, sub in recs }
+            if self.item_model:
+                # files that items still refer to are kept, with their records
+                items = self.item_model.objects.filter(
+                    _submission__in=submissions
+                ).exclude(_file='')
+                submissions -= set(items.values_list('_submission', flat=True))
+            
+            remove_submission_dirs(list(submissions))
+            SubmissionRecord.objects.filter(
+                id__in=[ rec_id for rec_id, sub in recs if sub in submissions ]
+            ).update(deleted=True)
+            
+            progress['done'] += len(recs)
+            progress['last'] = recs[-1][0]
+            cache.set(key, progress, timeout=timeout)
+        
+        return progress['done']
+    
+    def archive_path(self):
+        name = f'{self.program.db_slug}_{self.db_slug}_drafts.jsonl.gz'
+        return os.path.join(settings.MEDIA_ROOT, 'archives', name)
+    
+    def archive_drafts(self, path, submissions, items):
+        # each batch is appended as another gzip member, one draft per line
+        by_submission = {}
+        for item in items.values() if items is not None else []:
+            by_submission.setdefault(item['_submission_id'], []).append(item)
+        
+        with gzip.open(path, 'at') as f:
+            for submission in submissions.values():
+                submission['_items'] = by_submission.get(submission['_id'], [])
+                f.write(json.dumps(submission, cls=DjangoJSONEncoder) + '\n')
+    
     def timed_completion(self):
         if 'timed_completion' in self.options:
             return self.options['timed_completion']
@@ -440,6 +716,23 @@ class Form(AutoSlugModel):
         content = loader.get_template('formative/emails/' + n + '.html')
         return subject, content
     
+    def compiled_email_templates(self, name):
+        # a form's own templates are compiled once per process, and again only
+        # when the source changes. the template loader caches the defaults
+        form_emails = self.emails()
+        if name not in form_emails: return self.load_email_templates(name)
+        
+        subject = form_emails[name]['subject']
+        content = form_emails[name]['content']
+        digest = hashlib.sha1(f'{subject}\0{content}'.encode()).hexdigest()
+        key = (self.id, name)
+        if key in compiled_emails and compiled_emails[key][0] == digest:
+            return compiled_emails[key][1:]
+        
+        compiled = (digest, Template(subject), Template(content))
+        compiled_emails[key] = compiled
+        return compiled[1:]
+    
     def email_templates(self):
         emails = self.emails()
         for name in ('continue', 'confirmation'):
@@ -526,9 +819,13 @@ class FormDependency(models.Model):
 
 
 class FormBlockManager(PolymorphicManager):
-    def get_by_natural_key(self, program_slug, form_slug, name):
-        return self.non_polymorphic().get(form__program__slug=program_slug,
-                                          form__slug=form_slug, name=name)
+    def get_by_natural_key(self, program_slug, form_slug, name, page=None,
+                           rank=None):
+        # exports add the page and rank, as names aren't unique within a form
+        args = {'form__program__slug': program_slug, 'form__slug': form_slug,
+                'name': name}
+        if page is not None: args.update(page=page, _rank=rank)
+        return self.non_polymorphic().get(**args)
 
 class FormBlock(PolymorphicModel, RankedModel):
     class Meta(PolymorphicModel.Meta, RankedModel.Meta):
@@ -552,6 +849,13 @@ class FormBlock(PolymorphicModel, RankedModel):
                                               verbose_name='negate dependency')
     objects = FormBlockManager()
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        # the name as loaded, for the label signals to see if it was changed
+        self._old_name = None
+        if 'name' not in self.get_deferred_fields(): self._old_name = self.name
+    
     def __str__(self):
         return self.name
     
@@ -559,6 +863,14 @@ class FormBlock(PolymorphicModel, RankedModel):
         return self.form.natural_key() + (self.name,)
     natural_key.dependencies = ['formative.form']
     
+    def save_base(self, *args, **kwargs):
+        if self.pk and self._old_name is None: # name was deferred
+            query = FormBlock.objects.non_polymorphic().filter(pk=self.pk)
+            self._old_name = query.values_list('name', flat=True).first()
+        
+        super().save_base(*args, **kwargs)
+        self._old_name = self.name # the signals have been sent
+    
     def rank_group(self):
         return FormBlock.objects.filter(form=self.form, page=self.page)
     
@@ -922,6 +1234,106 @@ class SubmissionRecord(models.Model):
     number = models.PositiveBigIntegerField(null=True, blank=True)
     deleted = models.BooleanField(default=False)
 
+
+class FilesExport(models.Model):
+    class Meta:
+        ordering = ['-created']
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    program = models.ForeignKey(Program, models.SET_NULL, null=True, blank=True)
+    form = models.SlugField(max_length=64, allow_unicode=True)
+    created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # item id -> [size, mtime] for each file included, or already up to date
+    manifest = models.JSONField(default=dict, blank=True, editable=False)
+    
+    def __str__(self):
+        return f'{timezone.localtime(self.created):%Y-%m-%d %H:%M}'
+    
+    def file_name(self):
+        return f'{self.id}.zip'
+    
+    def path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'exports', self.file_name())
+    
+    def delete_file(self):
+        if os.path.isfile(self.path()): os.remove(self.path())
+        # the record is kept, as the base of later downloads of what changed
+        self.size = None
+        self.save(update_fields=['size'])
+
+class EmailCampaign(models.Model):
+    class Meta:
+        ordering = ['-created']
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    program = models.ForeignKey(Program, models.SET_NULL, null=True, blank=True)
+    form = models.SlugField(max_length=64, allow_unicode=True)
+    subject = models.TextField()
+    content = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f'{timezone.localtime(self.created):%Y-%m-%d %H:%M}'
+
+class EmailRecipient(models.Model):
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['campaign', 'submission'],
+                             name='unique_campaign_submission')
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'status'])
+        ]
+    
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('pending')
+        SENDING = 'sending', _('sending')
+        SENT = 'sent', _('sent')
+        FAILED = 'failed', _('failed')
+    
+    campaign = models.ForeignKey(EmailCampaign, models.CASCADE,
+                                 related_name='recipients')
+    submission = models.UUIDField()
+    status = models.CharField(max_length=16, choices=Status.choices,
+                              default=Status.PENDING)
+    # when a shard claimed it for sending
+    claimed = models.DateTimeField(null=True, blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+class OutboxEmail(models.Model):
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['sent', 'created'])
+        ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    program = models.ForeignKey(Program, models.SET_NULL, null=True, blank=True)
+    form = models.SlugField(max_length=64, allow_unicode=True)
+    submission = models.UUIDField()
+    name = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True)
+    # when a worker took it for sending, and when it was given up on
+    claimed = models.DateTimeField(null=True, blank=True)
+    failed = models.DateTimeField(null=True, blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    def __str__(self):
+        return f'{self.name} ({self.submission})'
+    
+    def queue(self):
+        from ..tasks import send_outbox_email
+        
+        try: send_outbox_email.delay(str(self.id))
+        except Exception: pass # it stays in the outbox, for send_outbox_emails
+
 # abstract classes, used as templates for the dynamic models:
 
 class Submission(models.Model):
@@ -934,9 +1346,9 @@ class Submission(models.Model):
     _valid = models.PositiveIntegerField(default=0, editable=False)
     # an array of N block id arrays, those skipped for form dependency not met:
     _skipped = models.JSONField(default=list, blank=True, editable=False)
-    _created = models.DateTimeField(auto_now_add=True)
-    _modified = models.DateTimeField(auto_now=True)
-    _submitted = models.DateTimeField(null=True, blank=True)
+    _created = models.DateTimeField(auto_now_add=True, db_index=True)
+    _modified = models.DateTimeField(auto_now=True, db_index=True)
+    _submitted = models.DateTimeField(null=True, blank=True, db_index=True)
     
     @classmethod
     def _get_form(cls):
@@ -954,27 +1366,24 @@ class Submission(models.Model):
                 'sid': self._id}
         return reverse('submission', kwargs=args)
     
-    def _update_context(self, form, context):
+    def _update_context(self, form, context, blocks=None):
         context['review_link'] = submission_link(self, form, rest='review')
         
-        for block in form.visible_blocks():
-            if block.block_type() == 'custom':
-                context[block.name] = getattr(self, block.name)
-            elif block.block_type() == 'stock':
-                class Obj: pass
-                obj = Obj()
-                obj.__dict__ = { n: getattr(self, block.stock.field_name(n))
-                                 for n in block.stock.widget_names() }
-                if len(obj.__dict__) > 1: context[block.name] = obj
-                elif not len(obj.__dict__): context[block.name] = obj
-                else: context[block.name] = next(iter(obj.__dict__.values()))
+        if blocks is None: blocks = form.email_context_blocks()
+        for name, fields in blocks:
+            if fields is None:
+                context[name] = getattr(self, name)
+                continue
+            class Obj: pass
+            obj = Obj()
+            obj.__dict__ = { n: getattr(self, field)
+                             for n, field in fields.items() }
+            if len(obj.__dict__) > 1: context[name] = obj
+            elif not len(obj.__dict__): context[name] = obj
+            else: context[name] = next(iter(obj.__dict__.values()))
     
     def _send_email(self, form, name, **kwargs):
-        form_emails = form.emails()
-        if name in form_emails:
-            subject = Template(form_emails[name]['subject'])
-            template = Template(form_emails[name]['content'])
-        else: subject, template = form.load_email_templates(name)
+        subject, template = form.compiled_email_templates(name)
         
         context = {
             'submission': self, 'form': form,
@@ -985,9 +1394,26 @@ class Submission(models.Model):
         return send_email(template=template, to=self._email,
                           subject=subject, context=context, **kwargs)
     
-    def _submit(self):
-        self._submitted = timezone.now()
-        self.save()
+    def _queue_email(self, form, name):
+        email = OutboxEmail.objects.create(program=form.program, form=form.slug,
+                                           submission=self._id, name=name)
+        transaction.on_commit(email.queue)
+    
+    def _set_submitted(self, submitted):
+        # in a partitioned table, an email address is only unique among the
+        # drafts and among the submitted entries, so moving between them can
+        # collide with another entry for the same address
+        old, self._submitted = self._submitted, submitted
+        try:
+            with transaction.atomic(): self.save()
+        except IntegrityError as e:
+            self._submitted = old
+            if submitted: msg = _('This email address was already submitted.')
+            else: msg = _('A draft for this email address already exists.')
+            raise ValidationError(msg, code='unique') from e
+    
+    def _submit(self): self._set_submitted(timezone.now())
+    def _unsubmit(self): self._set_submitted(None)
     
     def _collections(self, queryset=None, form=None):
         if not form: form = self._get_form()
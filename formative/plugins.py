@@ -4,19 +4,40 @@ from django.core.exceptions import ImproperlyConfigured
 import sys
 
 
-def get_all_plugins(form=None):
-    plugins = []
+plugin_index = None # app name -> plugin meta, in app config order
+matching_plugins = {} # module -> plugin meta of the app it's in
+
+def populate_plugin_index():
+    global plugin_index
+    apps.check_apps_ready()
+    
+    index = {}
     for app in apps.get_app_configs():
         if hasattr(app, 'FormativePluginMeta'):
             meta = app.FormativePluginMeta
             meta.module, meta.app = app.name, app
-            
-            if hasattr(app, 'is_available'):
-                if not app.is_available(form): continue
-            
-            plugins.append(meta)
+            index[app.name] = meta
+    plugin_index = index
+    matching_plugins.clear()
+
+def get_plugin_index():
+    if plugin_index is None: populate_plugin_index()
+    return plugin_index
+
+def get_all_plugins(form=None):
+    # availability is remembered on the form instance, for its lifetime
+    if form is not None and '_all_plugins' in form.__dict__:
+        return list(form._all_plugins)
     
-    return plugins
+    plugins = []
+    for meta in get_plugin_index().values():
+        if hasattr(meta.app, 'is_available'):
+            if not meta.app.is_available(form): continue
+        
+        plugins.append(meta)
+    
+    if form is not None: form._all_plugins = plugins
+    return list(plugins)
 
 def get_available_plugins(form=None):
     plugins = get_all_plugins(form)
@@ -25,14 +46,15 @@ def get_available_plugins(form=None):
              if not plugin.name.startswith('.') }
 
 def get_matching_plugin(module):
-    for app in apps.get_app_configs():
-        if hasattr(app, 'FormativePluginMeta'):
-            if app.name == module or module.startswith(app.name + '.'):
-                meta = app.FormativePluginMeta
-                meta.module, meta.app = app.name, app
-                
-                return meta
-    return None
+    if module in matching_plugins: return matching_plugins[module]
+    
+    # the first plugin in INSTALLED_APPS order that contains the module
+    matching_plugins[module] = None
+    for name, meta in get_plugin_index().items():
+        if name == module or module.startswith(name + '.'):
+            matching_plugins[module] = meta
+            break
+    return matching_plugins[module]
 
 
 class PluginConfig(AppConfig):
@@ -1,9 +1,9 @@
 from django.db.models import Q, Exists, OuterRef
-from django.db.models.signals import pre_save, post_save, \
-    pre_delete, post_delete
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.apps import apps
 from django.dispatch import Signal, dispatcher, receiver
 from django.utils.text import capfirst
+import weakref
 
 from .models import Form, FormBlock, CustomBlock, CollectionBlock, FormLabel, \
     SubmissionRecord
@@ -41,14 +41,6 @@ def form_pre_delete(sender, instance, **kwargs):
     if form.status != Form.Status.DRAFT:
         form.unpublish()
 
-@receiver(pre_save, sender=CustomBlock)
-def customblock_pre_save(sender, instance, raw, **kwargs):
-    if raw: return
-    
-    if instance.pk:
-        orig = CustomBlock.objects.get(pk=instance.pk)
-        instance._old_name = orig.name
-
 def default_text(text):
     return capfirst(text.replace('_', ' '))
 
@@ -72,52 +64,22 @@ def customblock_post_save(sender, instance, created, raw, **kwargs):
     text = default_text(block.name)
     if style != FormLabel.LabelStyle.WIDGET: text += ':' # TODO: i18n
     
-    l = None
-    if new:
-        l = FormLabel(form=block.form, path=block.name, style=style, text=text)
-    elif block.name != block._old_name:
-        try:
-            l = FormLabel.objects.get(form=block.form, path=block._old_name,
-                                      style=style)
-            l.path = block.name
-        except FormLabel.DoesNotExist: pass
-    if l: l.save()
+    old_name = not new and block.name != block._old_name and block._old_name
+    names = [block.name] + (old_name and [old_name] or [])
+    sync = LabelSync(block.form, *names)
+    sync.claim(old_name or block.name, style, block.name) \
+        or new and sync.create(block.name, style, text)
     
-    if block.type != CustomBlock.InputType.CHOICE: return
-    paths = []
+    if block.type != CustomBlock.InputType.CHOICE: return sync.apply()
+    widget = FormLabel.LabelStyle.WIDGET
     for c in 'choices' in block.options and block.choices() or []:
-        text = default_text(c)
-        new_path = '.'.join((block.name, c))
-        if not new and block.name != block._old_name:
-            path = '.'.join((block._old_name, c))
-        else: path=new_path
-        
-        l = None
-        if not new:
-            try:
-                l = FormLabel.objects.get(form=block.form, path=path,
-                                          style=FormLabel.LabelStyle.WIDGET)
-                l.path = new_path
-            except FormLabel.DoesNotExist: pass
-        
-        if not l:
-            l = FormLabel(form=block.form, path=new_path,
-                          style=FormLabel.LabelStyle.WIDGET, text=text)
-        
-        l.save()
-        paths.append(l.path)
-    
-    delete_sub_labels(block.form, block.name, paths)
-    if not new and block._old_name != block.name:
-        delete_sub_labels(block.form, block._old_name)
-
-@receiver(pre_save, sender=FormBlock)
-def formblock_pre_save(sender, instance, raw, **kwargs):
-    if raw: return
+        path = '.'.join((block.name, c))
+        old_path = old_name and '.'.join((old_name, c)) or path
+        sync.claim(old_path, widget, path) \
+            or sync.create(path, widget, default_text(c))
     
-    if instance.pk:
-        orig = FormBlock.objects.get(pk=instance.pk)
-        instance._old_name = orig.name
+    sync.apply(lambda label: label.path.split('.', 1)[0] in names
+                             and '.' in label.path)
 
 @receiver(post_save, sender=FormBlock)
 def formblock_post_save(sender, instance, created, raw, **kwargs):
@@ -125,42 +87,23 @@ def formblock_post_save(sender, instance, created, raw, **kwargs):
     
     if 'stock' in instance.__dict__: del instance.stock # don't use cache
     block, stock, new = instance, instance.stock, created
-
-    # get stock block's FormLabels and save
-    paths = []
+    
+    old_name = not new and block.name != block._old_name and block._old_name
+    names = [block.name] + (old_name and [old_name] or [])
+    sync = LabelSync(block.form, *names)
     for new_path, (style, text) in stock.widget_labels().items():
-        if not new and block.name != block._old_name:
+        path = new_path
+        if old_name:
             if '.' in new_path:
                 widget = new_path[new_path.index('.')+1:]
-                path = '.'.join((block._old_name, widget))
-            else: path = block._old_name
-        else: path = new_path
-        
-        l = None
-        if not new:
-            try:
-                l = FormLabel.objects.get(form=block.form, path=path,
-                                          style=style)
-                l.path = new_path
-            except FormLabel.DoesNotExist: pass
+                path = '.'.join((old_name, widget))
+            else: path = old_name
         
-        if not l:
-            l = FormLabel(form=block.form, path=new_path, style=style,
-                          text=text)
-        l.save()
-        paths.append(l.path)
+        sync.claim(path, style, new_path) \
+            or sync.create(new_path, style, text)
     
-    delete_sub_labels(block.form, block.name, paths)
-    if not new and block._old_name != block.name:
-        delete_sub_labels(block.form, block._old_name)
-
-@receiver(pre_save, sender=CollectionBlock)
-def collectionblock_pre_save(sender, instance, raw, **kwargs):
-    if raw: return
-    
-    if instance.pk:
-        orig = CollectionBlock.objects.get(pk=instance.pk)
-        instance._old_name = orig.name
+    sync.apply(lambda label: label.path.split('.', 1)[0] in names
+                             and '.' in label.path)
 
 @receiver(post_save, sender=CollectionBlock)
 def collectionblock_post_save(sender, instance, created, raw, **kwargs):
@@ -182,53 +125,77 @@ def collectionblock_post_save(sender, instance, created, raw, **kwargs):
     block.form.custom_blocks().filter(~Exists(refs),
                                       page=0, _rank__gt=1).delete()
     
+    # labels under the block's name and id name, or the old ones if renamed
     text, style = default_text(block.name) + ':', FormLabel.LabelStyle.VERTICAL
-    paths, id_name, l = [], f'{block.name}{block.id}', None
-    try: l = FormLabel.objects.get(form=block.form, path=id_name+'_')
-    except FormLabel.DoesNotExist:
-        l, _ = FormLabel.objects.get_or_create(form=block.form, path=block.name,
-                                               defaults={'style': style,
-                                                         'text': text})
-    paths.append(l.path)
+    id_name = f'{block.name}{block.id}'
+    old_name = not new and block.name != block._old_name and block._old_name
+    names = [block.name, id_name]
+    if old_name: names += [old_name, f'{old_name}{block.id}']
+    sync = LabelSync(block.form, *names)
+    
+    sync.claim(id_name + '_') or sync.claim(block.name) \
+        or sync.create(block.name, style, text)
+    if block.fixed: return sync.apply() # no implementation yet for fixed
     
-    if block.fixed: return # no implementation yet for fixed + collection
     style = FormLabel.LabelStyle.WIDGET
-    for name in block.collection_fields():
-        text = default_text(name)
+    for name in fields:
         path, id_path = '.'.join((block.name, name)), id_name + f'.{name}_'
-        try: l = FormLabel.objects.get(form=block.form, path=id_path)
-        except FormLabel.DoesNotExist:
-            l, _ = FormLabel.objects.get_or_create(form=block.form, path=path,
-                                                   defaults={'style': style,
-                                                             'text': text})
-        paths.append(l.path)
+        sync.claim(id_path) or sync.claim(path) \
+            or sync.create(path, style, default_text(name))
     
     # TODO: field name change: update name of existing label rather than delete
     
-    delete_sub_labels(block.form, id_name, paths, True)
-    if not new and block._old_name != block.name:
-        delete_sub_labels(block.form, f'{block._old_name}{block.id}', True)
+    # the name's labels are shared with other collections of the same name
+    shared = {}
+    for name in names[::2]:
+        blocks = block.form.collections(name=name).exclude(id=block.pk)
+        shared[name] = { f for b in blocks for f in b.collection_fields() }
     
-    labels = block.form.labels
-    blocks = block.form.collections(name=block.name).exclude(id=block.pk)
-    if not blocks: delete_sub_labels(block.form, block.name, paths)
-    else:
-        for label in labels.filter(path__startswith=block.name+'.'):
-            if label.path in paths: continue
-            field = label.path[len(block.name)+1:]
-            if not blocks.filter(any_name_field(_=field)): label.delete()
+    def stale(label):
+        name, _, field = label.path.partition('.')
+        if not field: return False
+        if name in shared: return field not in shared[name]
+        return label.path.endswith('_') # id name sub-label
+    sync.apply(stale)
+
+class LabelSync:
+    # the labels under some block names, read in one query. labels are
+    # claimed for keeping, or created; then the changes are written in bulk
+    def __init__(self, form, *names):
+        scope = Q()
+        for name in names:
+            scope |= Q(path__in=(name, name + '_'))
+            scope |= Q(path__startswith=name + '.')
+        
+        self.form, self.labels = form, {}
+        for label in form.labels.filter(scope):
+            self.labels.setdefault(label.path, []).append(label)
+        self.kept, self.renamed, self.created = set(), [], []
+    
+    def claim(self, path, style=None, new_path=None):
+        for label in self.labels.get(path, []):
+            if style and label.style != style or label.pk in self.kept: continue
+            self.kept.add(label.pk)
+            if new_path and new_path != path:
+                label.path = new_path
+                self.renamed.append(label)
+            return label
+        return None
+    
+    def create(self, path, style, text):
+        label = FormLabel(form=self.form, path=path, style=style, text=text)
+        self.created.append(label)
+        return label
     
-    if not new and block._old_name != block.name:
-        blocks = block.form.collections(name=block._old_name)
-        if not blocks: delete_sub_labels(block.form, block._old_name)
-        else:
-            for label in labels.filter(path__startswith=block._old_name+'.'):
-                if not blocks.filter(any_name_field(_=field)): label.delete()
-
-def delete_sub_labels(form, name, exclude=[], id=False):
-    sl = form.labels.filter(path__startswith=name+'.').exclude(path__in=exclude)
-    if id: sl = sl.filter(path__endswith='_')
-    sl.delete()
+    def apply(self, stale=None):
+        # labels not claimed are deleted if stale. deleting goes first, so a
+        # label renamed or created can take the path of a deleted one
+        deleted = [ label.pk for labels in self.labels.values()
+                    for label in labels
+                    if label.pk not in self.kept and stale and stale(label) ]
+        if deleted: FormLabel.objects.filter(pk__in=deleted).delete()
+        if self.renamed: FormLabel.objects.bulk_update(self.renamed, ['path'])
+        if self.created: FormLabel.objects.bulk_create(self.created)
 
 def delete_block_labels(form, name):
     form.labels.filter(Q(path=name) | Q(path__startswith=name+'.')).delete()
@@ -271,33 +238,76 @@ def populate_app_cache():
     apps.check_apps_ready()
     for config in apps.app_configs.values(): app_cache[config.name] = config
 
-    
+
+def weak_ref(receiver):
+    if hasattr(receiver, '__self__') and hasattr(receiver, '__func__'):
+        return weakref.WeakMethod(receiver)
+    try: return weakref.ref(receiver)
+    except TypeError: return lambda: receiver # only connected with weak=False
+
+
 class FormPluginSignal(Signal):
-    def _is_active(self, sender, receiver):
-        searchpath = receiver.__module__
-        app = None
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        self.module_apps = {} # receiver module -> name of the app it's in
+        self.form_receivers = {} # form id -> (plugins, active receivers)
+    
+    def connect(self, *args, **kwargs):
+        super().connect(*args, **kwargs)
+        self.form_receivers.clear()
+    
+    def disconnect(self, *args, **kwargs):
+        disconnected = super().disconnect(*args, **kwargs)
+        self.form_receivers.clear()
+        return disconnected
+    
+    def _receiver_app(self, receiver):
+        module = receiver.__module__
+        if module in self.module_apps: return self.module_apps[module]
+        
+        searchpath, app = module, None
         while True:
             app = app_cache.get(searchpath)
             if '.' not in searchpath or app: break
             searchpath, _ = searchpath.rsplit('.', 1)
         
-        return sender and app and app.name in sender.get_plugins()
+        self.module_apps[module] = app and app.name
+        return self.module_apps[module]
+    
+    def _is_active(self, sender, receiver, plugins=None):
+        if plugins is None: plugins = sender and sender.get_plugins()
+        return sender and self._receiver_app(receiver) in plugins
+    
+    def active_receivers(self, sender):
+        # keyed by the form's plugins too, so enabling or disabling one is seen.
+        # as in Django's sender_receivers_cache, weak references are cached,
+        # so that receivers connected weakly can still be garbage collected
+        plugins = tuple(sender.get_plugins())
+        cached = self.form_receivers.get(sender.id)
+        if cached and cached[0] == plugins and not self._dead_receivers:
+            receivers = [ ref() for ref in cached[1] ]
+            if None not in receivers: return receivers
+        
+        if not app_cache: populate_app_cache()
+        receivers = [ receiver for receiver in self._live_receivers(sender)
+                      if self._is_active(sender, receiver, plugins) ]
+        refs = [ weak_ref(receiver) for receiver in receivers ]
+        self.form_receivers[sender.id] = (plugins, refs)
+        return receivers
     
     def send(self, sender, **kwargs):
         if sender and not isinstance(sender, Form):
             raise ValueError('Signal sender needs to be a form.')
         
         responses = []
-        if not self.receivers: return responses
+        if not sender or not self.receivers: return responses
         if self.sender_receivers_cache.get(sender) is dispatcher.NO_RECEIVERS:
             return responses
         
-        if not app_cache: populate_app_cache()
-        
-        for receiver in self._live_receivers(sender):
-            if self._is_active(sender, receiver):
-                response = receiver(signal=self, sender=sender, **kwargs)
-                responses.append((receiver, response))
+        for receiver in self.active_receivers(sender):
+            response = receiver(signal=self, sender=sender, **kwargs)
+            responses.append((receiver, response))
         return responses
 
 
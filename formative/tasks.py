@@ -1,50 +1,236 @@
 from django.apps import apps
+from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
+from django.db.models import Q, F
 from django.template import Template
 from django.utils import timezone
 from celery import shared_task
-import time
+from datetime import timedelta
+import os, time, smtplib, logging, zipfile
 
-from .models import Form
-from .utils import send_email, submission_link
+from .filetype import FileType
+from .models import Form, FilesExport, EmailCampaign, EmailRecipient, \
+    OutboxEmail
+from .utils import send_email, submission_link, template_names, TokenBucket, \
+    submission_file_paths, read_ahead, get_file_extension
 
 
-EMAILS_PER_SECOND = 10
+logger = logging.getLogger('django.request')
+
+# a fresh Form builds its models again, registering them over the last ones.
+# a worker keeps each form's models instead, until the versions checked by
+# DynamicModelMiddleware say they've changed
+form_models = {}
+
+def with_models(form):
+    keys = ['models_version', f'models_version_{form.id}']
+    versions = cache.get_many(keys)
+    version = tuple( versions.get(key) or 0 for key in keys )
+    if form.id in form_models and form_models[form.id][0] == version:
+        _, form.model, form.item_model = form_models[form.id]
+    else: form_models[form.id] = (version, form.model, form.item_model)
+    return form
+
+def create_email_campaign(form, id_values, subject, content):
+    campaign = EmailCampaign.objects.create(program=form.program,
+                                            form=form.slug,
+                                            subject=subject, content=content)
+    EmailRecipient.objects.bulk_create([
+        EmailRecipient(campaign=campaign, submission=pk) for pk in id_values
+    ], batch_size=1000)
+    return campaign
+
+def claimable_recipients(recipients):
+    # pending, or claimed by a worker that has since been lost
+    Status = EmailRecipient.Status
+    lost = timezone.now() - timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+    return recipients.filter(Q(status=Status.PENDING)
+                             | Q(status=Status.SENDING, claimed__lt=lost))
+
+def transient_email_error(e):
+    # 4xx replies, and connection problems, are worth trying again later
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    return isinstance(e, OSError)
+
+@shared_task
+def send_email_campaign(campaign_id):
+    # pending recipients are split into shards, sent by workers in parallel
+    campaign = EmailCampaign.objects.get(id=campaign_id)
+    pending = claimable_recipients(campaign.recipients)
+    ids = [ str(pk) for pk in pending.order_by('submission')
+                                     .values_list('submission', flat=True) ]
     
+    size = settings.EMAIL_SHARD_SIZE
+    for i in range(0, len(ids), size):
+        send_email_shard.delay(campaign_id, ids[i:i+size])
+    if not ids: complete_email_campaign(campaign)
+    return len(ids)
+
 @shared_task
 def send_email_for_submissions(model_name, id_values, subject_str, content_str):
-    model = apps.get_model(f'formative.{model_name}')
-    queryset = model.objects.filter(pk__in=id_values)
-    
-    subject, content = Template(subject_str), Template(content_str)
-    iterator = queryset.iterator()
-    batch, form, last_time, done, n = [], None, None, False, 0
-    while not done:
-        submission = next(iterator, None)
-        if not submission: done = True
-        else: batch.append(submission)
-        
-        if len(batch) == EMAILS_PER_SECOND or done:
-            if last_time:
-                this_time = time.time()
-                remaining = last_time + 1 - this_time
-                if remaining > 0: time.sleep(remaining)
-            last_time = time.time()
+    # tasks queued under the old name, before campaigns were introduced
+    form = apps.get_model(f'formative.{model_name}')._get_form()
+    campaign = create_email_campaign(form, id_values, subject_str, content_str)
+    return send_email_campaign(str(campaign.id))
+
+def complete_email_campaign(campaign):
+    Status = EmailRecipient.Status
+    unsent = campaign.recipients.filter(status__in=[Status.PENDING,
+                                                    Status.SENDING])
+    if unsent.exists(): return
+    campaigns = EmailCampaign.objects.filter(id=campaign.id, completed=None)
+    campaigns.update(completed=timezone.now())
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             max_retries=settings.EMAIL_SHARD_RETRIES)
+def send_email_shard(self, campaign_id, id_values):
+    campaign = EmailCampaign.objects.get(id=campaign_id)
+    form = with_models(Form.objects.get(program=campaign.program,
+                                        slug=campaign.form))
+    model = form.model
+    subject = Template(campaign.subject)
+    content = Template(campaign.content)
+    
+    # the form's structure is looked up once, and only fields that the
+    # templates refer to are fetched
+    names = template_names(campaign.subject, campaign.content)
+    blocks = [ b for b in form.email_context_blocks() if b[0] in names ]
+    fields = ['_id', '_email', '_valid', '_submitted']
+    for name, block_fields in blocks:
+        fields += block_fields.values() if block_fields is not None else [name]
+    fields += [ f.name for f in model._meta.concrete_fields if f.name in names ]
+    num_pages = form.num_pages()
+    
+    Status = EmailRecipient.Status
+    recipients = campaign.recipients.filter(submission__in=id_values)
+    claimable = claimable_recipients(recipients)
+    queryset = model.objects.filter(pk__in=claimable.values('submission'))
+    queryset = queryset.only(*fields)
+    
+    final = self.request.retries >= self.max_retries
+    bucket = TokenBucket('formative:emails', settings.EMAILS_PER_SECOND)
+    n, deferred = 0, 0
+    with mail.get_connection() as conn:
+        for sub in queryset.iterator():
+            # claimed first, so a redelivered or concurrent shard skips it
+            recipient = claimable.filter(submission=sub._id)
+            if not recipient.update(status=Status.SENDING,
+                                    claimed=timezone.now()): continue
+            
+            link = submission_link(sub, form, num_pages=num_pages)
+            context = {
+                'submission': sub, 'form': form,
+                'submission_link': link
+            }
+            if sub._submitted: sub._update_context(form, context,
+                                                   blocks=blocks)
             
-            with mail.get_connection() as conn:
-                for sub in batch:
-                    if not form: form = sub._get_form()
-                    context = {
-                        'submission': sub, 'form': form,
-                        'submission_link': submission_link(sub, form)
-                    }
-                    if sub._submitted: sub._update_context(form, context)
-                    n += 1
-                    send_email(content, sub._email, subject,
-                               context=context, connection=conn)
-            batch = []
+            bucket.take()
+            try:
+                conn.open() # if it was closed after an error
+                send_email(content, sub._email, subject,
+                           context=context, connection=conn)
+                status, error, sent = Status.SENT, '', timezone.now()
+                n += 1
+            except Exception as e:
+                status, error = Status.FAILED, str(e) or type(e).__name__
+                sent = timezone.now()
+                if not final and transient_email_error(e):
+                    status, sent = Status.PENDING, None
+                    deferred += 1
+                conn.close()
+            recipients.filter(submission=sub._id).update(
+                status=status, error=error, sent=sent
+            )
+    
+    # any left were deleted after the campaign was created
+    recipients.filter(status=Status.PENDING).exclude(
+        submission__in=model.objects.values('pk')
+    ).update(status=Status.FAILED, error='submission not found')
+    
+    # the rest are tried again later, and those still claimed by another
+    # worker are picked up then if it was lost
+    if not final and recipients.filter(status__in=[Status.PENDING,
+                                                   Status.SENDING]).exists():
+        countdown = 60 * 2 ** self.request.retries
+        if not deferred: countdown = settings.EMAIL_CLAIM_TIMEOUT
+        raise self.retry(countdown=countdown)
+    complete_email_campaign(campaign)
     return n
 
+def claimable_outbox():
+    # not yet sent, and not claimed, or claimed by a worker since lost
+    lost = timezone.now() - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+    emails = OutboxEmail.objects.filter(sent=None, failed=None)
+    return emails.filter(Q(claimed=None) | Q(claimed__lt=lost))
+
+@shared_task(bind=True, max_retries=settings.OUTBOX_RETRIES)
+def send_outbox_email(self, email_id):
+    # claimed by an update that commits right away, so no lock is held while
+    # sending, and it's sent once even if it's queued again
+    emails = claimable_outbox().filter(id=email_id)
+    if not emails.update(claimed=timezone.now(), attempts=F('attempts') + 1):
+        return False
+    email = OutboxEmail.objects.get(id=email_id)
+    
+    forms = Form.objects.filter(program=email.program, slug=email.form)
+    form, submission = forms.first(), None
+    if form: with_models(form)
+    if form and form.model:
+        submission = form.model.objects.filter(_id=email.submission).first()
+    
+    error = None
+    if not submission: error = 'submission not found'
+    else:
+        try: submission._send_email(form=form, name=email.name)
+        except Exception as e: error = e
+    
+    email.claimed = None
+    if not error:
+        email.sent, email.error = timezone.now(), ''
+        email.save()
+        return True
+    
+    email.error = str(error) or type(error).__name__
+    if isinstance(error, str) or self.request.retries >= self.max_retries:
+        email.failed = timezone.now()
+        email.save()
+        logger.error(f'Email {email} was not sent after {email.attempts} '
+                     f'attempts: {email.error}')
+        return False
+    
+    email.save()
+    raise self.retry(exc=error, countdown=60 * 2 ** self.request.retries)
+
+@shared_task
+def send_outbox_emails():
+    # those that couldn't be queued when they were created, and those whose
+    # worker was lost while sending
+    created = timezone.now() - timedelta(minutes=settings.OUTBOX_QUEUE_MINUTES)
+    emails = claimable_outbox().filter(Q(attempts=0, created__lt=created)
+                                       | Q(claimed__isnull=False))
+    for email in emails: email.queue()
+    return len(emails)
+
+@shared_task
+def expire_drafts():
+    forms = Form.objects.exclude(status=Form.Status.DRAFT)
+    return { str(form): with_models(form).expire_drafts()
+             for form in forms.filter(options__has_key='draft_retention_days') }
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def purge_submission_files(form_id, target):
+    try: form = with_models(Form.objects.get(id=form_id))
+    except Form.DoesNotExist: return
+    
+    # the admin's lock is released even if the purge fails
+    try: return form.purge_files(target)
+    finally: cache.delete(form.files_purge_key())
+
 @shared_task
 def timed_complete_form(form_id, datetime_val):
     try: form = Form.objects.get(id=form_id)
@@ -57,3 +243,52 @@ def timed_complete_form(form_id, datetime_val):
     form.completed = timezone.now()
     form.save()
     return True
+
+@shared_task
+def build_files_export(export_id, id_values, since_id=None):
+    export = FilesExport.objects.get(id=export_id)
+    form = with_models(Form.objects.get(program=export.program,
+                                        slug=export.form))
+    since = None
+    if since_id: since = FilesExport.objects.get(id=since_id).manifest
+    
+    items = form.item_model.objects.filter(_submission__in=id_values)
+    items = items.exclude(_file='').order_by('_submission')
+    files = list(items.values_list('_id', '_submission', '_file'))
+    paths = submission_file_paths(files, since=since, manifest=export.manifest)
+    
+    path = export.path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    modified = time.localtime()[:6]
+    try:
+        # the archive is seekable here, so zipfile can stream each member
+        # and then go back to fill in its size and CRC
+        with zipfile.ZipFile(path + '.part', 'w', allowZip64=True) as archive:
+            for name, data in read_ahead(paths):
+                info = zipfile.ZipInfo(name, date_time=modified)
+                info.external_attr = 0o644 << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                filetype = FileType.by_extension(get_file_extension(name))
+                if filetype and filetype.compressed:
+                    info.compress_type = zipfile.ZIP_STORED
+                
+                with archive.open(info, 'w', force_zip64=True) as f:
+                    for chunk in data: f.write(chunk)
+        os.replace(path + '.part', path)
+    except Exception as e:
+        if os.path.exists(path + '.part'): os.remove(path + '.part')
+        export.error = str(e) or type(e).__name__
+        export.save()
+        raise
+    
+    export.size, export.completed = os.path.getsize(path), timezone.now()
+    export.save()
+    
+    cutoff = timezone.now() - timedelta(days=settings.EXPORT_FILES_DAYS)
+    # size is cleared once an export's file is deleted
+    for old in FilesExport.objects.filter(created__lt=cutoff,
+                                          size__isnull=False):
+        old.delete_file()
+    # exports whose task never finished can't be used as a base for updates
+    FilesExport.objects.filter(created__lt=cutoff, completed=None).delete()
+    return export.size
@@ -1,24 +1,180 @@
-from django.db.models import Model, Q, OuterRef, Max, Count
+from django.db.models import Model, Q, OuterRef, Subquery, Value, Max, Count
+from django.db.models import Index
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
 from django.conf import settings
+from django.db import connection
 from django.core import mail
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.template import Context, Template, loader
 from django.utils.translation import gettext_lazy as _
 from django.contrib import admin
-import os, glob
+import os, io, re, glob, csv, itertools, queue, shutil, threading, tempfile
+import time
+from datetime import datetime
 from pathlib import Path
-import pyexcel
+from concurrent.futures import ThreadPoolExecutor
 import markdown
+import redis
 from markdown_link_attr_modifier import LinkAttrModifierExtension
+from stream_zip import ZIP_64, stream_zip
 from urllib.parse import quote
 
+try: import pyarrow, pyarrow.ipc, pyarrow.parquet
+except ImportError: pyarrow = None # only needed for columnar exports
+
+
+def clear_site_cache():
+    # sites are cached per process by Django's SITE_CACHE. sites_version
+    # tells SitesMiddleware in other processes to clear theirs too
+    from .models import Site
+    Site.objects.clear_cache()
+    
+    if cache.get('sites_version') is None:
+        cache.set('sites_version', 1, timeout=None)
+    else: cache.incr('sites_version')
 
 def get_current_site(request):
     from .models import Site
-    try: return Site.objects.get_current(request)
-    except Site.DoesNotExist: pass
+    # resolved once per request
+    if request is not None and hasattr(request, 'site'): return request.site
+    
+    try: site = Site.objects.get_current(request)
+    except Site.DoesNotExist: site = None
+    if request is not None: request.site = site
+    return site
+
+def estimated_count(model):
+    # the planner's row estimate, kept up to date by (auto)analyze. a
+    # partitioned table has none of its own, so its partitions are summed
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT sum(greatest(reltuples, 0)) FROM pg_class '
+                       'WHERE oid = %s::regclass OR oid IN (SELECT inhrelid '
+                       'FROM pg_inherits WHERE inhparent = %s::regclass)',
+                       [table, table])
+        return int(cursor.fetchone()[0] or 0)
+
+def table_partitions(cursor, table):
+    # the partitions of a partitioned table, or None for an ordinary table
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass",
+                   [connection.ops.quote_name(table)])
+    if not cursor.fetchone()[0]: return None
+    cursor.execute('SELECT c.relname FROM pg_inherits JOIN pg_class c '
+                   'ON c.oid = inhrelid WHERE inhparent = %s::regclass '
+                   'ORDER BY c.relname', [connection.ops.quote_name(table)])
+    return [ name for name, in cursor.fetchall() ]
+
+def partition_index(cursor, index_name, partition, columns=None):
+    # the partition's index already attached to a partitioned index, or else
+    # an unattached plain btree index on the same columns that can be
+    q = connection.ops.quote_name
+    cursor.execute('SELECT c.relname FROM pg_inherits JOIN pg_index i '
+                   'ON i.indexrelid = inhrelid JOIN pg_class c '
+                   'ON c.oid = inhrelid WHERE inhparent = %s::regclass '
+                   'AND i.indrelid = %s::regclass', [q(index_name), q(partition)])
+    row = cursor.fetchone()
+    if row: return row[0], True
+    if not columns: return None, False
+    
+    cursor.execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = %s::regclass AND am.amname = 'btree'
+        AND i.indisvalid AND NOT i.indisunique AND i.indnkeyatts = i.indnatts
+        AND i.indexprs IS NULL AND i.indpred IS NULL
+        AND 0 = ALL(i.indoption::int2[])
+        AND NOT EXISTS (SELECT FROM pg_inherits WHERE inhrelid = i.indexrelid)
+        AND NOT EXISTS (SELECT FROM unnest(i.indclass::oid[]) AS o(oid)
+                        JOIN pg_opclass oc ON oc.oid = o.oid
+                        WHERE NOT oc.opcdefault)
+        AND ARRAY(SELECT a.attname::text
+                  FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(num, n)
+                  JOIN pg_attribute a ON a.attrelid = i.indrelid
+                  AND a.attnum = k.num ORDER BY k.n) = %s::text[]
+        ORDER BY c.relname LIMIT 1
+    """, [q(partition), columns])
+    row = cursor.fetchone()
+    return row and row[0], False
+
+def add_missing_indexes(model, schema_editor, concurrently=True):
+    # the model's indexes that its table lacks, by default created without
+    # locking it against writes. CREATE INDEX CONCURRENTLY can't run in a
+    # transaction
+    table, connection = model._meta.db_table, schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+        partitions = table_partitions(cursor, table)
+        cursor.execute('SELECT c.relname FROM pg_index JOIN pg_class c '
+                       'ON c.oid = indexrelid WHERE indrelid = %s::regclass '
+                       'AND NOT indisvalid', [schema_editor.quote_name(table)])
+        invalid = { name for name, in cursor.fetchall() }
+    indexed = [ c['columns'] for n, c in constraints.items()
+                if c['index'] and n not in invalid ]
+    
+    indexes = list(model._meta.indexes)
+    for field in model._meta.local_concrete_fields:
+        if not field.db_index or field.unique or [field.column] in indexed:
+            continue
+        index = Index(fields=[field.name])
+        index.set_name_with_model(model)
+        indexes.append(index)
     
-    return None
+    added = []
+    for index in indexes:
+        if index.name in constraints and index.name not in invalid: continue
+        if partitions is None:
+            if index.name in invalid: # left by an interrupted build
+                schema_editor.execute(index.remove_sql(
+                    model, schema_editor, concurrently=concurrently
+                ))
+            schema_editor.execute(index.create_sql(model, schema_editor,
+                                                   concurrently=concurrently))
+        else: add_partitioned_index(model, index, partitions, schema_editor,
+                                    concurrently)
+        added.append(index.name)
+    return added
+
+def add_partitioned_index(model, index, partitions, schema_editor,
+                          concurrently=True):
+    # a partitioned table can't be indexed concurrently. instead, its index is
+    # created ON ONLY the table, so it starts out invalid and empty, then each
+    # partition's index is built (unless it already has one) and attached
+    table = model._meta.db_table
+    statement = index.create_sql(model, schema_editor)
+    statement.template = statement.template.replace(
+        'CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1
+    ).replace(' ON ', ' ON ONLY ', 1)
+    schema_editor.execute(statement)
+    
+    columns = None
+    if index.fields and not (index.condition or index.opclasses
+                             or index.include or index.expressions) \
+       and not any(order for _, order in index.fields_orders):
+        columns = [ model._meta.get_field(name).column
+                    for name in index.fields ]
+    
+    for partition in partitions:
+        with schema_editor.connection.cursor() as cursor:
+            name, attached = partition_index(cursor, index.name, partition,
+                                             columns)
+        if attached: continue
+        if not name:
+            name = index.name + partition[len(table):]
+            # what's left of an earlier, interrupted build
+            schema_editor.execute(schema_editor._delete_index_sql(
+                model, name, concurrently=concurrently
+            ))
+            statement = index.create_sql(model, schema_editor,
+                                         concurrently=concurrently)
+            statement.rename_table_references(table, partition)
+            statement.parts['name'] = schema_editor.quote_name(name)
+            schema_editor.execute(statement)
+        
+        schema_editor.execute('ALTER INDEX %s ATTACH PARTITION %s' % (
+            schema_editor.quote_name(index.name), schema_editor.quote_name(name)
+        ))
 
 def user_programs(queryset, path, request, or_cond=None):
     if request.user.is_superuser:
@@ -72,10 +228,50 @@ def send_email(template, to, subject, context={}, connection=None):
                               connection=connection)
     return email.send()
 
+def template_names(*sources):
+    # every identifier used inside template tags and variables
+    names = set()
+    for source in sources:
+        for tag in re.findall(r'{[{%](.*?)[%}]}', source, re.DOTALL):
+            names.update(re.findall(r'\w+', tag))
+    return names
+
+class TokenBucket:
+    # shared by every worker: tokens are refilled at rate/s, up to capacity
+    SCRIPT = """
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+local tokens, last = tonumber(bucket[1]) or capacity, tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - last) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'time', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+    
+    def __init__(self, key, rate, capacity=None):
+        self.key, self.rate = key, rate
+        self.capacity = capacity or max(rate, 1)
+        client = redis.Redis.from_url(settings.REDIS_URL)
+        self.script = client.register_script(self.SCRIPT)
+    
+    def take(self):
+        while True:
+            wait = float(self.script(keys=[self.key],
+                                     args=[self.rate, self.capacity]))
+            if not wait: return
+            time.sleep(wait)
+
 
 class TabularExport:
+    CHUNK_SIZE = 500
+    
     def __init__(self, form, queryset, **kwargs):
         self.args, self.fields, self.collections = kwargs, [], {}
+        self.form = form
         
         names = []
         for name in self.args:
@@ -89,25 +285,21 @@ class TabularExport:
         blocks = { 'block_'+b.name: b
                    for b in form.submission_blocks().filter(name__in=names) }
         
-        self.items = {}
+        self.items_qs = None
         if self.collections:
             item_model = form.item_model
+            self.items_qs = item_model.objects.filter(
+                _collection__in=self.collections
+            )
             # item_model's _submission rel doesn't recognize original queryset
             qs = form.model.objects.filter(pk__in=queryset) # but this works
             
-            sub_items = item_model.objects.filter(_submission__in=qs)
-            items_qs = sub_items.filter(_collection__in=self.collections)
-            # TODO order should be by block_rank, cf Submission._collections()
-            for item in items_qs.order_by('_collection', '_block', '_rank'):
-                app = self.items.setdefault(item._submission_id, {})
-                app_col = app.setdefault(item._collection, [])
-                app_col.append(item)
-            
+            sub_items = self.items_qs.filter(_submission__in=qs)
             for c in self.collections:
                 if self.collections[c][0] < 0: continue
-                lengths = [ len(app[c])
-                            for app in self.items.values() if c in app ]
-                self.collections[c][0] = lengths and max(lengths) or 0
+                counts = sub_items.filter(_collection=c)
+                counts = counts.values('_submission').annotate(n=Count('*'))
+                self.collections[c][0] = counts.aggregate(m=Max('n'))['m'] or 0
         
         for name in self.args:
             if name.startswith('block_'):
@@ -138,68 +330,260 @@ class TabularExport:
         
         return ret
     
-    def data_row(self, submission, sub_items):
-        row = [submission._email]
-        
-        for name in self.fields:
-            val = getattr(submission, name)
-            if val is None: out = ''
-            else: out = str(val)
-            row.append(out)
-        
-        def item_val(item, field):
-            if field == '_file' and item._file:
-                return 'https://' + settings.DJANGO_SERVER + item._file.url
-            val = getattr(item, field)
-            if val is None: return ''
-            return str(val)
+    def item_fields(self):
+        fields = []
+        for _, cfields in self.collections.values():
+            fields += [ f for f in cfields if f not in fields ]
+        return fields
+    
+    def file_url(self, name):
+        if not name: return None
+        storage = self.form.item_model._meta.get_field('_file').storage
+        return 'https://' + settings.DJANGO_SERVER + storage.url(name)
+    
+    def item_ordering(self):
+        # form's order also orders blocks' items with the same collection name
+        from .models import FormBlock
+        block = FormBlock.objects.filter(form=self.form, pk=OuterRef('_block'))
+        return (Subquery(block.values('page')), Subquery(block.values('_rank')),
+                '_rank')
+    
+    def combined_values(self):
+        # items of combined collections are aggregated per submission in SQL
+        annotations, item_model = {}, self.form.item_model
+        for collection, (n, fields) in self.collections.items():
+            if n >= 0: continue
+            items = self.items_qs.filter(_submission=OuterRef('_id'),
+                                         _collection=collection)
+            for i, field in enumerate(fields):
+                field_type = item_model._meta.get_field(field)
+                field_type = field_type.get_internal_type()
+                if field_type in ('CharField', 'TextField'):
+                    agg = StringAgg(Coalesce(field, Value('')), ', ',
+                                    ordering=self.item_ordering())
+                else: agg = ArrayAgg(field, ordering=self.item_ordering())
+                values = items.exclude(_file='') if field == '_file' else items
+                values = values.values('_submission').annotate(v=agg)
+                annotations[f'_combined_{i}_{collection}'] = \
+                    Subquery(values.values('v'))
+        return annotations
+    
+    def data_row(self, values, sub_items):
+        num_values = len(self.fields) + 2 # followed by combined aggregates
+        row = [ '' if val is None else str(val)
+                for val in values[1:num_values] ]
         
+        combined = iter(values[num_values:])
+        item_fields = self.item_fields()
         for collection, (n, fields) in self.collections.items():
-            col_items = sub_items.setdefault(collection, [])
             if n < 0:
                 for field in fields:
-                    vals = [ item_val(item, field) for item in col_items ]
-                    sep = ' ' if field == '_file' else ', '
-                    out = sep.join(vals)
-                    row.append(out)
-            else:
-                for item in col_items:
-                    for field in fields: row.append(item_val(item, field))
-                row.extend([''] * (n-len(col_items)) * len(fields))
-                
+                    vals = next(combined)
+                    if field == '_file':
+                        vals = ' '.join(map(self.file_url, vals or []))
+                    elif isinstance(vals, list):
+                        vals = ', '.join('' if v is None else str(v)
+                                         for v in vals)
+                    row.append(vals or '')
+                continue
+            
+            col_items = sub_items.get(collection, [])
+            indices = [ item_fields.index(field) for field in fields ]
+            for item in col_items:
+                for i in indices:
+                    val = item[i]
+                    row.append('' if val is None else str(val))
+            row.extend([''] * (n-len(col_items)) * len(fields))
+        
         return row
     
-    def data_rows(self, queryset):
-        ret = []
-        for submission in queryset:
-            sub_items = self.items.setdefault(submission._id, {})
-            row = self.data_row(submission, sub_items)
-            ret.append(row)
-        return ret
+    def chunk_items(self, submission_ids, collections=None):
+        # values of item_fields() by collection, for each submission
+        items = {}
+        if self.items_qs is None: return items
+        if collections is None: collections = list(self.collections)
+        if not collections: return items
+        
+        fields = self.item_fields()
+        file_index = fields.index('_file') if '_file' in fields else None
+        items_qs = self.items_qs.filter(_submission__in=submission_ids,
+                                        _collection__in=collections)
+        items_qs = items_qs.order_by('_collection', *self.item_ordering())
+        for values in items_qs.values_list('_submission', '_collection',
+                                           *fields):
+            item = list(values[2:])
+            if file_index is not None:
+                item[file_index] = self.file_url(item[file_index])
+            app = items.setdefault(values[0], {})
+            app.setdefault(values[1], []).append(item)
+        return items
     
-    def data(self, queryset):
-        ret = [self.header_row()]
-        ret += self.data_rows(queryset)
-        return ret
+    def submission_chunks(self, queryset, combine=True):
+        # submission values, and then their items, are fetched chunk at a time
+        collections = list(self.collections)
+        values, annotations = ['_id', '_email'] + self.fields, {}
+        if combine:
+            annotations = self.combined_values()
+            collections = [ c for c, (n, _) in self.collections.items()
+                            if n > 0 ]
+        
+        queryset = queryset.annotate(**annotations)
+        queryset = queryset.values_list(*values, *annotations)
+        iterator = queryset.iterator(chunk_size=self.CHUNK_SIZE)
+        while (chunk := list(itertools.islice(iterator, self.CHUNK_SIZE))):
+            ids = [ values[0] for values in chunk ]
+            yield chunk, self.chunk_items(ids, collections)
+    
+    def data_rows(self, queryset):
+        for chunk, items in self.submission_chunks(queryset):
+            for values in chunk:
+                yield self.data_row(values, items.get(values[0], {}))
     
     def csv_response(self, filename, queryset):
-        data = self.data(queryset)
+        class Echo:
+            def write(self, value): return value
+        
+        writer = csv.writer(Echo())
+        rows = itertools.chain([self.header_row()], self.data_rows(queryset))
+        response = StreamingHttpResponse(( writer.writerow(row)
+                                           for row in rows ),
+                                         content_type='text/csv')
+        
+        disp = f"attachment; filename*=UTF-8''" + quote(filename)
+        response['Content-Disposition'] = disp
+        return response
+    
+    def arrow_type(self, model, name):
+        field = model._meta.get_field(name)
+        internal_type = field.get_internal_type()
+        if internal_type.endswith('IntegerField'): return pyarrow.int64()
+        if internal_type == 'BooleanField': return pyarrow.bool_()
+        if internal_type == 'DateTimeField':
+            return pyarrow.timestamp('us', tz='UTC')
+        if internal_type == 'DateField': return pyarrow.date32()
+        if internal_type in ('FloatField', 'DecimalField'):
+            return pyarrow.float64()
+        return pyarrow.string()
+    
+    def arrow_schemas(self):
+        # submissions table, and a child table of their collection items
+        string, model = pyarrow.string(), self.form.model
+        columns = [('id', string), ('email', string)]
+        for name in self.fields:
+            header = name[1:] if name.startswith('_') else name
+            columns.append((header, self.arrow_type(model, name)))
+        if not self.collections: return pyarrow.schema(columns), None
+        
+        sub_schema, item_model = pyarrow.schema(columns), self.form.item_model
+        columns = [('submission', string), ('collection', string),
+                   ('rank', pyarrow.int64())]
+        for name in self.item_fields():
+            if name == '_file': columns.append(('file', string))
+            else: columns.append((name, self.arrow_type(item_model, name)))
+        return sub_schema, pyarrow.schema(columns)
+    
+    def arrow_batch(self, rows, schema):
+        columns = [ [] for field in schema ]
+        for row in rows:
+            for column, field, val in zip(columns, schema, row):
+                if val is not None and field.type == pyarrow.string():
+                    val = str(val)
+                column.append(val)
+        return pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+    
+    def arrow_batches(self, queryset, sub_schema, item_schema):
+        for chunk, items in self.submission_chunks(queryset, combine=False):
+            sub_batch = self.arrow_batch(chunk, sub_schema)
+            if not item_schema:
+                yield sub_batch, None
+                continue
+            
+            rows = []
+            for values in chunk:
+                sub_items = items.get(values[0], {})
+                for collection, col_items in sub_items.items():
+                    for rank, item in enumerate(col_items, start=1):
+                        rows.append([values[0], collection, rank] + item)
+            yield sub_batch, self.arrow_batch(rows, item_schema)
+    
+    def columnar_response(self, filename, queryset, format='parquet'):
+        # columns are typed according to the submission and item models. the
+        # submissions table is sent as it's written; an item table is written
+        # to a temporary file alongside it, and follows it in the zip
+        if format == 'parquet': writer_class = pyarrow.parquet.ParquetWriter
+        else: writer_class = pyarrow.ipc.new_file
+        
+        sub_schema, item_schema = self.arrow_schemas()
+        items_file = item_schema and tempfile.TemporaryFile()
+        
+        def submissions():
+            sink = StreamSink()
+            writers = [writer_class(sink, sub_schema)]
+            if item_schema:
+                writers.append(writer_class(items_file, item_schema))
+            
+            for batches in self.arrow_batches(queryset, sub_schema,
+                                              item_schema):
+                for writer, batch in zip(writers, batches):
+                    writer.write_batch(batch)
+                yield sink.drain()
+            for writer in writers: writer.close()
+            yield sink.drain()
         
-        stream = pyexcel.save_as(array=data, dest_file_type='csv')
-        response = HttpResponse(stream, content_type='text/csv')
+        def items():
+            with items_file:
+                items_file.seek(0)
+                while (data := items_file.read(settings.DOWNLOAD_CHUNK_SIZE)):
+                    yield data
         
+        if item_schema:
+            filename += '.zip'
+            modified = datetime.now()
+            content = stream_zip([
+                (f'submissions.{format}', modified, 0o644, ZIP_64,
+                 submissions()),
+                (f'items.{format}', modified, 0o644, ZIP_64, items())
+            ])
+        else: content, filename = submissions(), filename + '.' + format
+        
+        content_type = 'application/octet-stream'
+        response = StreamingHttpResponse(content, content_type=content_type)
         disp = f"attachment; filename*=UTF-8''" + quote(filename)
         response['Content-Disposition'] = disp
         return response
 
 
-def submission_link(s, form, rest=''):
+class StreamSink(io.RawIOBase):
+    # collects what a writer has written until it's sent. the position keeps
+    # counting, as writers record offsets in the file
+    def __init__(self):
+        super().__init__()
+        self.chunks, self.position = [], 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def submission_link(s, form, rest='', num_pages=None):
     server = settings.DJANGO_SERVER
     if ':' in server or server.endswith('.local'): proto = 'http'
     else: proto = 'https'
     
     if s._valid > 1 and not rest:
-        if s._valid == form.num_pages(): rest = f'page-{form.num_pages()}'
+        if num_pages is None: num_pages = form.num_pages()
+        if s._valid == num_pages: rest = f'page-{num_pages}'
         else: rest = f'page-{s._valid + 1}'
     
     return f'{proto}://{server}/{form.program.slug}/{form.slug}/{s._id}/{rest}'
@@ -215,14 +599,88 @@ def subtitle_path(path, lang):
     idx = path.rindex('.')
     return path[:idx] + '_s_' + lang + '.vtt'
 
-def delete_submission_files(files_recs):
-    for rec in files_recs:
-        submission_dir = os.path.join(settings.MEDIA_ROOT, str(rec.submission))
-        if not os.path.isdir(submission_dir): continue
+def remove_submission_dirs(submission_ids, threads=None):
+    # directory removal is I/O bound, but only a few are removed at once
+    if not threads: threads = settings.FILES_DELETE_THREADS
+    
+    def remove(submission_id):
+        submission_dir = os.path.join(settings.MEDIA_ROOT, str(submission_id))
+        shutil.rmtree(submission_dir, ignore_errors=True)
+    
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(remove, submission_ids): pass
+
+def submission_dir_entries(submission_id):
+    path = os.path.join(settings.MEDIA_ROOT, str(submission_id))
+    try:
+        with os.scandir(path) as it: return { e.name: e for e in it }
+    except FileNotFoundError: return {}
+
+def submission_file_paths(files, since=None, manifest=None):
+    # files is (item id, submission id, file name), ordered by submission. one
+    # listing per submission directory replaces the per-file existence checks.
+    # if given, manifest is filled with item id -> [size, mtime], and items
+    # whose size and mtime match those in the since manifest are skipped
+    last_sub, entries, pending = None, {}, []
+    for item_id, sub_id, name in files:
+        if sub_id != last_sub:
+            entries, last_sub = submission_dir_entries(sub_id), sub_id
+            pending = [ os.path.join(str(sub_id), n)
+                        for n in ('id.txt', 'submitted') if n in entries ]
         
-        for filename in os.listdir(submission_dir):
-            os.remove(os.path.join(submission_dir, filename))
-        os.rmdir(submission_dir)
+        entry = entries.get(os.path.basename(name))
+        if not entry: continue # already deleted
+        if since is not None or manifest is not None:
+            stat = entry.stat()
+            state = [stat.st_size, stat.st_mtime_ns]
+            if manifest is not None: manifest[str(item_id)] = state
+            if since and since.get(str(item_id)) == state: continue
+        
+        yield from pending
+        pending = []
+        yield name
+
+def read_ahead(paths, chunk_size=None, depth=None):
+    # yields (path, chunks) for files under MEDIA_ROOT, read on a background
+    # thread so that the disk stays busy while we write to the client.
+    # each chunks iterator must be consumed before advancing to the next path
+    if not chunk_size: chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+    if not depth: depth = settings.DOWNLOAD_READ_AHEAD
+    buffer, stop = queue.Queue(maxsize=depth), threading.Event()
+    
+    def put(kind, val=None):
+        while not stop.is_set():
+            try: buffer.put((kind, val), timeout=1)
+            except queue.Full: continue
+            return True
+        return False
+    
+    def reader():
+        try:
+            for path in paths:
+                if not put('file', path): return
+                with open(os.path.join(settings.MEDIA_ROOT, path), 'rb') as f:
+                    while (data := f.read(chunk_size)):
+                        if not put('data', data): return
+                if not put('end'): return
+            put('done')
+        except Exception as e: put('error', e)
+    
+    def chunks():
+        while True:
+            kind, val = buffer.get()
+            if kind == 'error': raise val
+            if kind == 'end': return
+            yield val
+    
+    threading.Thread(target=reader, daemon=True).start()
+    try:
+        while True:
+            kind, val = buffer.get()
+            if kind == 'error': raise val
+            if kind == 'done': return
+            yield val, chunks()
+    finally: stop.set() # reader exits if the client went away
 
 def delete_file(file):
     if os.path.isfile(file.path): os.remove(file.path)
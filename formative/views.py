@@ -3,6 +3,7 @@ from django.http import HttpResponse, HttpResponseRedirect, Http404, \
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django import forms
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import F, Min
 from django.forms.models import modelform_factory, modelformset_factory
@@ -82,15 +83,17 @@ class ProgramFormView(ProgramFormMixin, generic.edit.ProcessFormView,
         })
     
     def form_valid(self, form):
-        model = self.program_form.model
-        self.object, created = model.objects.get_or_create(
-            _email=form.cleaned_data['email']
-        )
+        model, email = self.program_form.model, form.cleaned_data['email']
+        try: self.object, created = model.objects.get_or_create(_email=email)
+        except model.MultipleObjectsReturned:
+            # partitioned, with a draft left over for a submitted address
+            submitted = model.objects.exclude(_submitted=None)
+            self.object = submitted.get(_email=email)
         
         if not self.object._submitted: template = 'continue'
         else: template = 'confirmation'
         
-        self.object._send_email(form=self.program_form, name=template)
+        self.object._queue_email(form=self.program_form, name=template)
         return super().form_valid(form)
 
 
@@ -292,8 +295,12 @@ class SubmissionView(ProgramFormMixin, generic.UpdateView):
             if res and res[0][1]: return res[0][1]
             
             # the draft submission will now be marked as submitted
-            self.program_form.submit_submission(self.object)
-            self.object._send_email(form=self.program_form, name='confirmation')
+            try: self.program_form.submit_submission(self.object)
+            except ValidationError as e:
+                form.add_error(None, e)
+                return self.form_invalid(form)
+            self.object._queue_email(form=self.program_form,
+                                     name='confirmation')
             
             return HttpResponseRedirect(reverse('form_thanks',
                                                 kwargs=self.url_args(id=False)))
@@ -5,6 +5,7 @@ Django settings for Formative project.
 import os, environ
 from pkg_resources import iter_entry_points
 from pathlib import Path
+from celery.schedules import crontab
 
 env = environ.Env()
 
@@ -109,6 +110,7 @@ DATABASES = {
     }
 }
 
+REDIS_URL = env('REDIS_URL', default='redis://localhost/')
 CACHES = {
     'default': env.cache_url('REDIS_URL', default='redis://localhost/',
          backend='django.core.cache.backends.redis.RedisCache'
@@ -126,6 +128,21 @@ DEFAULT_FROM_EMAIL = CONTACT_EMAIL
 ADMINS = [(env('ADMIN_NAME', default=''),
            env('ADMIN_EMAIL', default=TECH_EMAIL))]
 
+# bulk email: sending rate shared by all workers, and recipients per task
+EMAILS_PER_SECOND = env.float('EMAILS_PER_SECOND', default=10)
+EMAIL_SHARD_SIZE = env.int('EMAIL_SHARD_SIZE', default=200)
+# retries of a shard for temporary failures, and seconds before a recipient
+# claimed by a worker that was lost can be claimed again
+EMAIL_SHARD_RETRIES = env.int('EMAIL_SHARD_RETRIES', default=5)
+EMAIL_CLAIM_TIMEOUT = env.int('EMAIL_CLAIM_TIMEOUT', default=10*60)
+
+# confirmation emails: attempts after the first, minutes before one that
+# couldn't be queued is queued again, and seconds before one claimed by a
+# worker that was lost can be claimed again
+OUTBOX_RETRIES = env.int('OUTBOX_RETRIES', default=5)
+OUTBOX_QUEUE_MINUTES = env.int('OUTBOX_QUEUE_MINUTES', default=10)
+OUTBOX_CLAIM_TIMEOUT = env.int('OUTBOX_CLAIM_TIMEOUT', default=10*60)
+
 
 AUTH_USER_MODEL = 'formative.User'
 AUTHENTICATION_BACKENDS = ('formative.backends.SiteAuthBackend',)
@@ -201,6 +218,23 @@ STATICFILES_STORAGE = \
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'media')
 MEDIA_URL = 'media/'
 
+# submission files download: read size, and number of chunks to read ahead
+DOWNLOAD_CHUNK_SIZE = env.int('DOWNLOAD_CHUNK_SIZE', default=1024*1024)
+DOWNLOAD_READ_AHEAD = env.int('DOWNLOAD_READ_AHEAD', default=16)
+
+# ZIP files built in the background are sent by nginx, from this internal URL
+EXPORTS_ACCEL_REDIRECT = env('EXPORTS_ACCEL_REDIRECT',
+                             default='' if DEBUG else '/exports/')
+EXPORT_FILES_DAYS = env.int('EXPORT_FILES_DAYS', default=7)
+
+# removing submission directories: number of them removed at the same time
+FILES_DELETE_THREADS = env.int('FILES_DELETE_THREADS', default=4)
+
+# purging files from the admin: submissions per chunk, and how long progress
+# is kept after the last chunk before a stalled purge can be started again
+FILES_PURGE_CHUNK_SIZE = env.int('FILES_PURGE_CHUNK_SIZE', default=200)
+FILES_PURGE_TIMEOUT = env.int('FILES_PURGE_TIMEOUT', default=60*60)
+
 STATICFILES_DIRS = (
     ("bundles", os.path.join(BASE_DIR, 'assets/bundles')),
 #    ("img", os.path.join(BASE_DIR, 'assets/img')),
@@ -213,6 +247,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CELERY_BROKER_URL = 'redis://localhost'
 CELERY_RESULT_BACKEND = 'redis://localhost'
+CELERY_BEAT_SCHEDULE = {
+    'send-outbox-emails': {
+        'task': 'formative.tasks.send_outbox_emails',
+        'schedule': 5 * 60,
+    },
+    'expire-drafts': {
+        'task': 'formative.tasks.expire_drafts',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
 
 
 JAZZMIN_SETTINGS = {
@@ -1,5 +1,8 @@
 import pytest
 
+from formative.models import Program, Form, FormBlock, CustomBlock, \
+    CollectionBlock, FormLabel, FormDependency
+
 
 @pytest.fixture(scope='session')
 def django_db_setup():
@@ -14,3 +17,147 @@ def django_db_setup():
 def db_no_rollback(request, django_db_setup, django_db_blocker):
     django_db_blocker.unblock()
     request.addfinalizer(django_db_blocker.restore)
+
+
+# test data: a program with a form, built up over the tests in test_data
+
+@pytest.fixture(scope='session')
+def program(db_no_rollback):
+    p = Program(name='Co-Prosperity')
+    p.save()
+    yield p
+
+@pytest.fixture(scope='session')
+def program_form(program):
+    opt = { 'review_pre': 'Review your application below:' }
+    f = Form(program=program, name='Exhibitions Application 2022', options=opt)
+    f.save()
+    yield f
+
+@pytest.fixture(scope='session')
+def stock_url_block(program_form):
+    b = FormBlock(form=program_form, name='website', options={'type': 'url'})
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def stock_address_block(program_form, stock_url_block):
+    b = FormBlock(form=program_form, name='address',
+                  options={'type': 'address'})
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def dependence_choice_block(program_form, stock_address_block):
+    b = CustomBlock(form=program_form, name='choice',
+                    type=CustomBlock.InputType.CHOICE,
+                    options={'choices': ['foo', 'bar', 'baz', 'qux']})
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def fixed_collection_block(program_form, dependence_choice_block):
+    b = CollectionBlock(form=program_form, name='preference',
+                        fixed=True, name1='preference',
+                        options={'choices': ['option #1', 'option #2',
+                                             'option #3'],
+                                 'span_tablet': 6, 'span_desktop': 6})
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def custom_text_block(program_form, fixed_collection_block):
+    b = CustomBlock(form=program_form, name='answer', page=2,
+                    type=CustomBlock.InputType.TEXT, max_chars=50)
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def custom_textarea_block(program_form, stock_address_block, custom_text_block):
+    b = CustomBlock(form=program_form, name='response', page=2,
+                    type=CustomBlock.InputType.TEXT,
+                    min_chars=1, max_chars=1000, num_lines=5, min_words=10,
+                    dependence=stock_address_block)
+    b.save()
+    FormDependency(block=b, value='yes').save()
+    yield b
+
+@pytest.fixture(scope='session')
+def collection_block_main(program_form, custom_textarea_block):
+    b = CollectionBlock(form=program_form, name='files', page=2,
+                        min_items=1, max_items=10, has_file=True,
+                        name1='caption', name2='timecode',
+                        options={'wide': ['caption'], 'autoinit_filename': True,
+                                 'file_types': ['image', 'document',
+                                                'audio', 'video']})
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def collection_block_optional(program_form, collection_block_main):
+    b = CollectionBlock(form=program_form, name='files', page=2,
+                        min_items=0, max_items=1, has_file=True)
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def custom_choice_block(program_form, dependence_choice_block,
+                        collection_block_optional):
+    b = CustomBlock(form=program_form, name='type', page=2,
+                    type=CustomBlock.InputType.CHOICE, required=True,
+                    options={'choices': ['foo', 'bar', 'baz']},
+                    dependence=dependence_choice_block)
+    b.save()
+    FormDependency(block=b, value='foo').save()
+    FormDependency(block=b, value='baz').save()
+    yield b
+
+@pytest.fixture(scope='session')
+def custom_numeric_block(program_form, dependence_choice_block,
+                         custom_choice_block):
+    b = CustomBlock(form=program_form, name='numitems', page=2,
+                    type=CustomBlock.InputType.NUMERIC,
+                    dependence=dependence_choice_block,
+                    negate_dependencies=True)
+    b.save()
+    FormDependency(block=b, value='foo').save()
+    FormDependency(block=b, value='qux').save()
+    yield b
+
+@pytest.fixture(scope='session')
+def custom_boolean_block(program_form, custom_numeric_block):
+    b = CustomBlock(form=program_form, name='optin', page=2,
+                    type=CustomBlock.InputType.BOOLEAN)
+    b.save()
+    yield b
+
+@pytest.fixture(scope='session')
+def published_form(program_form, custom_boolean_block):
+    program_form.publish()
+    yield program_form
+
+@pytest.fixture
+def partitioned_form(program):
+    form = Form(program=program, name='Partitioned', slug='partitioned',
+                db_slug='partitioned', options={'partitioned': True})
+    form.save()
+    form.publish()
+    yield form
+    form.unpublish()
+    form.delete()
+
+@pytest.fixture(scope='session')
+def altered_labels(program_form, custom_numeric_block, custom_boolean_block):
+    path = custom_boolean_block.name
+    label1 = FormLabel.objects.get(form=program_form, path=path)
+
+    label1.text = 'Sign up for our mailing list'
+    label1.save()
+    
+    path = custom_numeric_block.name
+    label2 = FormLabel.objects.get(form=program_form, path=path)
+    
+    label2.text = 'Number of items:'
+    label2.save()
+    
+    yield [label1, label2]
@@ -0,0 +1,222 @@
+import pytest
+from urllib.parse import parse_qsl
+
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.utils import timezone
+
+from formative.admin import FormativeAdminSite
+from formative.admin.formative import FormAdmin, FormBlockAdmin, \
+    SubmissionAdmin
+from formative.models import Form, FormBlock, CustomBlock, FormDependency
+
+
+@pytest.fixture
+def superuser(db_no_rollback):
+    User = get_user_model()
+    user, _ = User.objects.get_or_create(username='admin', is_superuser=True,
+                                         is_staff=True)
+    yield user
+
+@pytest.fixture
+def submission_admin(published_form, monkeypatch):
+    site = FormativeAdminSite()
+    site.submissions_registered = {}
+    monkeypatch.setattr(SubmissionAdmin, 'has_change_permission',
+                        lambda self, request, obj=None: True)
+    yield SubmissionAdmin(published_form.model, site)
+
+def changelist(model_admin, rf, user, params):
+    request = rf.get('/', params)
+    request.user = user
+    return model_admin.get_changelist_instance(request)
+
+def test_keyset_pages(published_form, submission_admin, superuser, rf):
+    model = published_form.model
+    for i in range(5): model(_email=f'keyset{i}@example.com').save()
+    # rows created together share a timestamp, across the page boundary
+    rows = model.objects.filter(_email__startswith='keyset')
+    rows.update(_created=timezone.now())
+    submission_admin.list_per_page = 2
+
+    try:
+        params, pages = {'q': 'keyset'}, []
+        while params is not None:
+            cl = changelist(submission_admin, rf, superuser, params)
+            pages.append([ obj._email for obj in cl.result_list ])
+            params = cl.keyset_url and dict(parse_qsl(cl.keyset_url[1:]))
+    finally: rows.delete()
+
+    assert [ len(page) for page in pages ] == [2, 2, 1]
+    assert sorted(sum(pages, [])) == [ f'keyset{i}@example.com'
+                                       for i in range(5) ]
+
+def test_keyset_estimated_count(published_form, submission_admin, superuser,
+                                rf, monkeypatch, django_assert_num_queries):
+    from formative.admin.formative import EstimatedCountPaginator
+    monkeypatch.setattr(EstimatedCountPaginator, 'estimate_over', 0)
+    monkeypatch.setattr('formative.admin.formative.estimated_count',
+                        lambda model: 1000)
+    model = published_form.model
+    for i in range(3): model(_email=f'estimate{i}@example.com').save()
+    submission_admin.list_per_page = 2
+
+    try:
+        cl = changelist(submission_admin, rf, superuser, {})
+        assert cl.result_count == 1000 and not cl.after
+        # a keyset page is estimated too: only its rows are queried
+        params = dict(parse_qsl(cl.keyset_url[1:]))
+        with django_assert_num_queries(1):
+            cl = changelist(submission_admin, rf, superuser, params)
+        assert cl.result_count == 1000 and cl.after
+        # but a filtered one is counted
+        cl = changelist(submission_admin, rf, superuser,
+                        {**params, 'q': 'estimate'})
+        assert cl.result_count < 1000
+    finally: model.objects.filter(_email__startswith='estimate').delete()
+
+def test_unpublish_summary(published_form, django_assert_num_queries):
+    model, item_model = published_form.model, published_form.item_model
+    subs = []
+    for i in range(3):
+        sub = model(_email=f'summary{i}@example.com')
+        sub.save()
+        for rank in range(i):
+            item_model(_submission=sub, _collection='files', _block=1).save()
+        subs.append(sub)
+    model_admin = FormAdmin(Form, FormativeAdminSite())
+
+    try:
+        # the totals, the items, the most recent submissions, and their items
+        with django_assert_num_queries(4):
+            summary = model_admin.unpublish_summary(published_form,
+                                                    sample_size=2)
+    finally:
+        item_model.objects.filter(_submission__in=subs).delete()
+        model.objects.filter(_email__startswith='summary').delete()
+
+    totals = summary['totals']
+    assert totals['total'] == totals['submitted'] + totals['drafts'] >= 3
+    assert totals['items'] >= 3
+    assert summary['submissions'] == [('summary2@example.com', 2),
+                                      ('summary1@example.com', 1)]
+    assert summary['more'] == totals['total'] - 2
+
+def copy_form(model_admin, records, slug):
+    fields = {'slug': slug, 'db_slug': slug.replace('-', ''), 'name': slug,
+              'status': Form.Status.DRAFT, 'completed': None}
+    return model_admin.import_form_records(records, form_fields=fields)[0]
+
+def form_graph(form):
+    # the definition, without any of its ids
+    def key(block): return block and (block.name, block.page, block._rank)
+    blocks = []
+    for block in form.blocks.select_related('dependence'):
+        values = { f.name: getattr(block, f.attname)
+                   for f in block._meta.concrete_fields
+                   if not f.is_relation and not f.primary_key }
+        values = sorted(values.items(), key=lambda item: item[0])
+        dependencies = sorted(block.dependencies.values_list('value',
+                                                             flat=True))
+        blocks.append((type(block).__name__, values, key(block.dependence),
+                       dependencies))
+    labels = sorted(form.labels.values_list('path', 'style', 'text'))
+    return blocks, labels
+
+def test_copy_form(published_form, django_assert_num_queries):
+    model_admin = FormAdmin(Form, FormativeAdminSite())
+    forms = Form.objects.filter(pk=published_form.pk)
+    copy = copy_form(model_admin, model_admin.form_records(forms), 'copy-a')
+    try:
+        assert form_graph(copy) == form_graph(published_form)
+
+        # a block with the same name as one on another page, depended on
+        choice = CustomBlock(form=copy, name='choice', page=3,
+                             type=CustomBlock.InputType.CHOICE,
+                             options={'choices': ['yes', 'no']})
+        choice.save()
+        followup = CustomBlock(form=copy, name='followup', page=3,
+                               type=CustomBlock.InputType.TEXT,
+                               dependence=choice)
+        followup.save()
+        FormDependency(block=followup, value='yes').save()
+
+        forms = Form.objects.filter(pk=copy.pk)
+        # a query per model, with the natural keys' relations joined in
+        with django_assert_num_queries(6):
+            records = list(model_admin.form_records(forms))
+
+        children = sum(r['model'] in ('formative.customblock',
+                                      'formative.collectionblock')
+                       for r in records)
+        # a bulk insert per model, except for the child blocks' rows
+        with django_assert_num_queries(6 + children):
+            copy2 = copy_form(model_admin, records, 'copy-b')
+        try:
+            assert form_graph(copy2) == form_graph(copy)
+            followup = copy2.blocks.get(name='followup')
+            assert (followup.dependence.name, followup.dependence.page) == \
+                ('choice', 3)
+        finally: copy2.delete()
+    finally: copy.delete()
+
+@pytest.fixture
+def draft_blocks(program):
+    form = Form(program=program, name='Moving', slug='moving',
+                db_slug='moving')
+    form.save()
+    blocks = {}
+    for name, page in (('a', 1), ('b', 1), ('c', 2), ('d', 2)):
+        blocks[name] = CustomBlock(form=form, name=name, page=page,
+                                   type=CustomBlock.InputType.TEXT,
+                                   dependence=name == 'c' and blocks['a']
+                                              or None)
+        blocks[name].save()
+    yield blocks
+    form.delete()
+
+def move_blocks(blocks, rf, user, data):
+    request = rf.post('/', data)
+    request.user, request.session = user, {}
+    request._messages = FallbackStorage(request)
+    model_admin = FormBlockAdmin(FormBlock, FormativeAdminSite())
+    queryset = FormBlock.objects.filter(pk__in=[ b.pk for b in blocks ])
+    return model_admin.move_blocks_action(request, queryset)
+
+def pages(blocks):
+    return [ (b.name, b.page, b._rank)
+             for b in FormBlock.objects.filter(pk__in=[ b.pk for b in blocks ])
+                                       .order_by('page', '_rank') ]
+
+def test_move_blocks_invalid(draft_blocks, rf, superuser):
+    a, b, c, d = draft_blocks.values()
+    before = pages([a, b, c, d])
+    # c depends on a, so a must stay before page 2
+    for page in ('2', '3', 'x', ''):
+        response = move_blocks([a, b], rf, superuser,
+                               {'_move': '1', 'page': page})
+        assert response.status_code == 200
+        assert 'page' in response.context_data['form'].errors
+    assert pages([a, b, c, d]) == before
+
+def test_move_blocks_mixed(draft_blocks, rf, superuser):
+    a, b, c, d = draft_blocks.values()
+    before = pages([a, b, c, d])
+    # blocks from pages 1 and 2 can't be moved together
+    response = move_blocks([b, d], rf, superuser, {'_move': '1', 'page': '3'})
+    assert response.status_code == 200
+    assert response.context_data['form'].non_field_errors()
+    assert pages([a, b, c, d]) == before
+
+def test_move_blocks(draft_blocks, rf, superuser, django_assert_num_queries):
+    a, b, c, d = draft_blocks.values()
+    response = move_blocks([b], rf, superuser, {'_move': '1', 'page': '2'})
+    assert response.status_code == 302
+    assert pages([a, b, c, d]) == [('a', 1, 1), ('c', 2, 1), ('d', 2, 2),
+                                   ('b', 2, 3)]
+
+    # the pages locked, the source page's ranks freed, the new ranks set
+    with django_assert_num_queries(3):
+        assert a.form.move_blocks([c.pk, b.pk], 3, 2) == 2
+    assert pages([a, b, c, d]) == [('a', 1, 1), ('d', 2, 1), ('c', 3, 1),
+                                   ('b', 3, 2)]
@@ -0,0 +1,164 @@
+import pytest
+import smtplib
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+
+from formative.models import EmailRecipient, OutboxEmail
+from formative.models.formative import Submission
+from formative import tasks
+
+
+Status = EmailRecipient.Status
+
+class Bucket:
+    def __init__(self, *args): pass
+    def take(self): pass
+
+@pytest.fixture
+def recipients(published_form, monkeypatch, mailoutbox):
+    monkeypatch.setattr(tasks, 'TokenBucket', Bucket)
+    form, ids = published_form, []
+    for i in range(4):
+        s = form.model(_email=f'campaign{i}@example.com', _valid=1)
+        s.save()
+        ids.append(str(s._id))
+    yield ids
+    form.model.objects.filter(_email__startswith='campaign').delete()
+
+def send_shard(campaign, ids, final=True):
+    return tasks.send_email_shard.apply(
+        (str(campaign.id), ids),
+        retries=final and tasks.send_email_shard.max_retries or 0
+    )
+
+def test_shard_claims(published_form, recipients, mailoutbox):
+    campaign = tasks.create_email_campaign(published_form, recipients,
+                                           'Hello', 'Content')
+    # one is being sent by another worker right now, one was already sent
+    sending, sent = campaign.recipients.all()[:2]
+    sending.status, sending.claimed = Status.SENDING, timezone.now()
+    sending.save()
+    sent.status = Status.SENT
+    sent.save()
+
+    assert send_shard(campaign, recipients).get() == 2
+    assert len(mailoutbox) == 2
+    assert campaign.recipients.filter(status=Status.SENT).count() == 3
+
+    # running it again, as when the task is redelivered, sends nothing
+    assert send_shard(campaign, recipients).get() == 0
+    assert len(mailoutbox) == 2
+    campaign.refresh_from_db()
+    assert campaign.completed is None # still sending
+
+def test_shard_transient_error(published_form, recipients, monkeypatch,
+                               mailoutbox):
+    attempts, send_email = [], tasks.send_email
+    def flaky_send_email(content, to, subject, **kwargs):
+        if to == 'campaign0@example.com':
+            attempts.append(to)
+            raise smtplib.SMTPResponseException(451, b'try again later')
+        if to == 'campaign1@example.com':
+            raise smtplib.SMTPResponseException(550, b'no such user')
+        send_email(content, to, subject, **kwargs)
+    monkeypatch.setattr(tasks, 'send_email', flaky_send_email)
+
+    campaign = tasks.create_email_campaign(published_form, recipients,
+                                           'Hello', 'Content')
+    send_shard(campaign, recipients, final=False)
+
+    # the temporary failure is retried, and only fails in the last attempt
+    assert len(attempts) == tasks.send_email_shard.max_retries + 1
+    assert len(mailoutbox) == 2
+    failed = campaign.recipients.filter(status=Status.FAILED)
+    assert sorted(r.error[:3] for r in failed) == ['(45', '(55']
+    campaign.refresh_from_db()
+    assert campaign.completed
+
+def test_send_email_for_submissions(published_form, recipients, monkeypatch,
+                                    mailoutbox):
+    from config.celery import app
+    model_name = published_form.model._meta.model_name
+    # the test program has no db_slug, so its models don't get one either
+    model = apps.get_model('formative', model_name)
+    monkeypatch.setattr(model._meta, 'program_slug', '', raising=False)
+    app.conf.task_always_eager = True
+    try:
+        tasks.send_email_for_submissions(model_name, recipients,
+                                         'Hello', 'Content')
+    finally: app.conf.task_always_eager = False
+
+    assert len(mailoutbox) == 4
+
+@pytest.fixture
+def outbox_email(published_form, recipients):
+    email = OutboxEmail(program=published_form.program,
+                        form=published_form.slug, submission=recipients[0],
+                        name='continue')
+    email.save()
+    yield email
+    email.delete()
+
+def test_outbox_email(outbox_email, mailoutbox):
+    assert tasks.send_outbox_email.apply((str(outbox_email.id),)).get()
+    assert len(mailoutbox) == 1
+    # queued again, it isn't sent again
+    assert not tasks.send_outbox_email.apply((str(outbox_email.id),)).get()
+    assert len(mailoutbox) == 1
+
+    outbox_email.refresh_from_db()
+    assert outbox_email.sent and not outbox_email.claimed
+    assert outbox_email.attempts == 1
+
+def test_outbox_email_claimed(outbox_email, mailoutbox):
+    outbox_email.claimed = timezone.now()
+    outbox_email.save()
+    assert not tasks.send_outbox_email.apply((str(outbox_email.id),)).get()
+    assert tasks.send_outbox_emails() == 0
+
+    # the worker that claimed it was lost
+    lost = timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT + 1)
+    outbox_email.claimed = timezone.now() - lost
+    outbox_email.save()
+    assert tasks.claimable_outbox().filter(id=outbox_email.id).exists()
+
+def test_outbox_email_failed(outbox_email, monkeypatch, mailoutbox, caplog):
+    def _send_email(self, **kwargs):
+        raise smtplib.SMTPServerDisconnected('went away')
+    monkeypatch.setattr(Submission, '_send_email', _send_email)
+
+    # retried, and given up on after the last attempt
+    tasks.send_outbox_email.apply((str(outbox_email.id),))
+    outbox_email.refresh_from_db()
+    assert outbox_email.attempts == settings.OUTBOX_RETRIES + 1
+    assert outbox_email.failed and not outbox_email.sent
+    assert outbox_email.error == 'went away'
+    assert 'was not sent' in caplog.text
+    assert tasks.send_outbox_emails() == 0
+
+def test_outbox_email_models(published_form, outbox_email, monkeypatch,
+                             mailoutbox):
+    import formative.models.formative as formative
+    built, create_model = [], formative.create_model
+    def counted(name, *args, **kwargs):
+        built.append(name)
+        return create_model(name, *args, **kwargs)
+    monkeypatch.setattr(formative, 'create_model', counted)
+    monkeypatch.setattr(tasks, 'form_models', {})
+
+    def send():
+        OutboxEmail.objects.filter(id=outbox_email.id).update(sent=None)
+        assert tasks.send_outbox_email.apply((str(outbox_email.id),)).get()
+
+    send()
+    assert built
+    # the worker's models are used again, until the form's tables change
+    built.clear()
+    send()
+    assert not built
+    published_form.cache_dirty(form_only=True)
+    send()
+    assert built
@@ -0,0 +1,84 @@
+import pytest
+import csv, io, os
+
+from formative.utils import TabularExport
+
+
+@pytest.fixture
+def submissions(published_form):
+    form = published_form
+    subs = []
+    for i in range(5):
+        s = form.model(_email=f'export{i}@example.com', answer=f'a,{i}')
+        s.save()
+        for rank in range(i % 3):
+            form.item_model(_submission=s, _collection='files', _block=1,
+                            caption=f'cap{rank}').save()
+        subs.append(s)
+    yield subs
+    form.item_model.objects.filter(_submission__in=subs).delete()
+    form.model.objects.filter(_email__startswith='export').delete()
+
+def export_rows(form, mode, assert_num_queries, num_queries):
+    queryset = form.model.objects.order_by('_email')
+    args = {'block_answer': 'on', 'collection_files': mode,
+            'cfield_files.caption': 'on'}
+    export = TabularExport(form, queryset, **args)
+    with assert_num_queries(num_queries):
+        response = export.csv_response('x.csv', queryset)
+        text = b''.join(response.streaming_content).decode()
+    return list(csv.reader(io.StringIO(text)))
+
+def test_export_combined(published_form, submissions,
+                         django_assert_num_queries):
+    # items of a combined collection are aggregated in the submissions query
+    rows = export_rows(published_form, 'combine', django_assert_num_queries, 1)
+
+    assert rows[0] == ['email', 'answer', 'files_caption']
+    assert rows[1] == ['export0@example.com', 'a,0', '']
+    assert rows[3] == ['export2@example.com', 'a,2', 'cap0, cap1']
+
+def test_export_repeat(published_form, submissions,
+                       django_assert_num_queries):
+    # the submissions, and then the items of the chunk's submissions
+    rows = export_rows(published_form, 'repeat', django_assert_num_queries, 2)
+
+    assert rows[0] == ['email', 'answer', 'files_caption', 'files_caption']
+    assert rows[2] == ['export1@example.com', 'a,1', 'cap0', '']
+    assert rows[3] == ['export2@example.com', 'a,2', 'cap0', 'cap1']
+
+def test_files_export_expired(published_form, submissions, settings, tmp_path,
+                              monkeypatch):
+    from datetime import timedelta
+    from django.utils import timezone
+    from formative.models import FilesExport
+    from formative.tasks import build_files_export
+
+    settings.MEDIA_ROOT = str(tmp_path)
+    form, old = published_form, timezone.now() - timedelta(days=365)
+    expired = FilesExport.objects.create(program=form.program, form=form.slug,
+                                         completed=old, size=1)
+    os.makedirs(os.path.dirname(expired.path()))
+    with open(expired.path(), 'wb') as f: f.write(b'x')
+    purged = FilesExport.objects.create(program=form.program, form=form.slug,
+                                        completed=old)
+    FilesExport.objects.filter(id__in=[expired.id, purged.id]) \
+                       .update(created=old)
+    export = FilesExport.objects.create(program=form.program, form=form.slug)
+
+    try:
+        deleted = []
+        delete_file = FilesExport.delete_file
+        def record(self):
+            deleted.append(self.id)
+            delete_file(self)
+        monkeypatch.setattr(FilesExport, 'delete_file', record)
+        build_files_export(str(export.id), [ s._id for s in submissions ])
+        # an export whose file was already deleted isn't visited again
+        assert deleted == [expired.id]
+        assert not os.path.exists(expired.path())
+        expired.refresh_from_db()
+        assert expired.size is None and expired.completed
+    finally:
+        FilesExport.objects.filter(id__in=[expired.id, purged.id,
+                                           export.id]).delete()
@@ -0,0 +1,104 @@
+import pytest
+
+from django.db.models.signals import post_save
+
+from formative.models import Form, FormBlock, CustomBlock, CollectionBlock
+from formative import signals
+
+
+@pytest.fixture
+def form(program):
+    form = Form(program=program, name='Labels', slug='labels',
+                db_slug='labels')
+    form.save()
+    yield form
+    form.delete()
+
+def labels(form):
+    # those of the blocks added, not the form's email label
+    return { label.path: (label.style, label.text, label.pk)
+             for label in form.labels.exclude(path='email') }
+
+def resave(block, name, django_assert_num_queries, num_queries):
+    # saved under the name, with the labels handler counted on its own
+    handler = { CustomBlock: signals.customblock_post_save,
+                FormBlock: signals.formblock_post_save,
+                CollectionBlock: signals.collectionblock_post_save }
+    handler, old_name = handler[type(block)], block.name
+    block.name = name
+    post_save.disconnect(handler, sender=type(block))
+    try: block.save()
+    finally: post_save.connect(handler, sender=type(block))
+
+    block._old_name = old_name
+    with django_assert_num_queries(num_queries):
+        handler(type(block), block, created=False, raw=False)
+    block._old_name = name
+
+def test_choice_labels(form, django_assert_num_queries):
+    block = CustomBlock(form=form, name='color', page=1,
+                        type=CustomBlock.InputType.CHOICE,
+                        options={'choices': ['red', 'blue']})
+    block.save()
+    created = labels(form)
+    assert { path: v[:2] for path, v in created.items() } == {
+        'color': ('vertical', 'Color:'),
+        'color.red': ('widget', 'Red'), 'color.blue': ('widget', 'Blue')
+    }
+
+    # unchanged: only the labels are read
+    resave(block, 'color', django_assert_num_queries, 1)
+    assert labels(form) == created
+
+    # renamed, with a choice removed and another added: a read, then a
+    # delete (which reads what it deletes), an update and an insert
+    block.options['choices'] = ['red', 'green']
+    resave(block, 'colour', django_assert_num_queries, 5)
+    renamed = labels(form)
+    assert set(renamed) == {'colour', 'colour.red', 'colour.green'}
+    # the kept labels are renamed, with any text they were given
+    assert renamed['colour'] == created['color']
+    assert renamed['colour.red'] == created['color.red']
+
+def test_stock_labels(form, django_assert_num_queries):
+    block = FormBlock(form=form, name='address', options={'type': 'address'})
+    block.save()
+    created = labels(form)
+    assert created and all(path == 'address' or path.startswith('address.')
+                           for path in created)
+
+    resave(block, 'address', django_assert_num_queries, 1)
+    resave(block, 'home', django_assert_num_queries, 2)
+    renamed = labels(form)
+    assert sorted(renamed) == sorted(path.replace('address', 'home', 1)
+                                     for path in created)
+    assert set(v[2] for v in renamed.values()) == \
+        set(v[2] for v in created.values())
+
+def test_collection_labels(form, django_assert_num_queries):
+    block = CollectionBlock(form=form, name='files', page=1,
+                            name1='caption', name2='credit')
+    block.save()
+    assert { path: v[:2] for path, v in labels(form).items() } == {
+        'files': ('vertical', 'Files:'),
+        'files.caption': ('widget', 'Caption'),
+        'files.credit': ('widget', 'Credit')
+    }
+    # labels for just this block, rather than all those named files
+    id_name = f'files{block.id}'
+    form.labels.create(path=id_name + '_', style='vertical', text='Own:')
+    form.labels.create(path=id_name + '.caption_', style='widget', text='Own')
+
+    # the id labels are claimed instead, so files.caption isn't needed. the
+    # item fields, unused item fields, labels and collections sharing the
+    # name are read, and then the delete
+    resave(block, 'files', django_assert_num_queries, 6)
+    assert set(labels(form)) == {'files', 'files.credit', id_name + '_',
+                                 id_name + '.caption_'}
+
+    # renamed, while another collection uses the old name's caption label
+    other = CollectionBlock(form=form, name='files', page=1, name1='caption')
+    other.save()
+    resave(block, 'docs', django_assert_num_queries, 8)
+    assert set(labels(form)) == {'files', 'files.caption', id_name + '_',
+                                 'docs', 'docs.caption', 'docs.credit'}
@@ -0,0 +1,151 @@
+import pytest
+import os
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+
+from formative.models import Form, SubmissionRecord
+
+
+def column_size(table, column):
+    with connection.cursor() as cursor:
+        description = connection.introspection.get_table_description(cursor,
+                                                                      table)
+    return { c.name: c.internal_size for c in description }[column]
+
+def test_update_table_unique(published_form):
+    model = published_form.model
+    table = model._meta.db_table
+    # a unique, indexed varchar column that is narrower than the model's
+    with connection.schema_editor() as editor:
+        editor.execute(f'ALTER TABLE {editor.quote_name(table)} ALTER COLUMN '
+                       '"_email" TYPE varchar(100)')
+    assert column_size(table, '_email') == 100
+
+    # its unique constraint and _like index are kept, not created again
+    assert published_form.update_table(model)
+    assert column_size(table, '_email') == model._meta.get_field('_email') \
+                                               .max_length
+    assert not published_form.update_table(model)
+
+def test_partition_indexes(partitioned_form):
+    table = partitioned_form.model._meta.db_table
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+        # the parent's indexes are partitioned, with both partitions' attached
+        cursor.execute('SELECT c.relname, i.indisvalid, array_agg('
+                       'p.indrelid::regclass::text) FROM pg_index i '
+                       'JOIN pg_class c ON c.oid = i.indexrelid '
+                       'LEFT JOIN pg_inherits h ON h.inhparent = i.indexrelid '
+                       'LEFT JOIN pg_index p ON p.indexrelid = h.inhrelid '
+                       'WHERE i.indrelid = %s::regclass GROUP BY 1, 2', [table])
+        indexes = cursor.fetchall()
+
+    assert { tuple(constraints[name]['columns'])
+             for name, _, _ in indexes } == {('_created',), ('_modified',),
+                                             ('_submitted',)}
+    for name, valid, partitions in indexes:
+        assert valid and sorted(partitions) == [table + '_d', table + '_s']
+
+def test_submit_partitioned(partitioned_form):
+    form, model = partitioned_form, partitioned_form.model
+    submitted = model(_email='twice@example.com')
+    submitted.save()
+    form.submit_submission(submitted)
+    # email addresses are unique among drafts, and among submitted entries
+    draft = model(_email='twice@example.com')
+    draft.save()
+
+    with pytest.raises(ValidationError):
+        form.submit_submission(draft)
+    assert draft._submitted is None
+    assert model.objects.get(pk=draft.pk)._submitted is None
+
+    with pytest.raises(ValidationError): submitted._unsubmit()
+    assert model.objects.get(pk=submitted.pk)._submitted
+
+@pytest.fixture
+def stale_drafts(published_form, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    model = published_form.model
+    drafts = []
+    for i in range(3):
+        draft = model(_email=f'stale{i}@example.com')
+        draft.save()
+        os.makedirs(tmp_path / str(draft._id))
+        drafts.append(draft)
+    old = timezone.now() - timedelta(days=10)
+    model.objects.filter(_email__startswith='stale').update(_modified=old)
+    published_form.options['draft_retention_days'] = 5
+    yield drafts
+    del published_form.options['draft_retention_days']
+    model.objects.filter(_email__startswith='stale').delete()
+
+def test_expire_drafts(published_form, stale_drafts, monkeypatch, tmp_path):
+    model = published_form.model
+    saved, atomic = stale_drafts[1], transaction.atomic
+    def save_first(*args, **kwargs):
+        # a draft is saved after the batch was selected, but before it's locked
+        model.objects.filter(pk=saved.pk).update(_modified=timezone.now())
+        return atomic(*args, **kwargs)
+    monkeypatch.setattr(transaction, 'atomic', save_first)
+
+    assert published_form.expire_drafts() == 2
+    assert list(model.objects.filter(_email__startswith='stale')) == [saved]
+    assert os.listdir(tmp_path) == [str(saved._id)]
+
+@pytest.fixture
+def files_records(published_form, collection_block_main, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    model = published_form.model
+    submissions = []
+    for i in range(2):
+        submission = model(_email=f'purge{i}@example.com')
+        submission.save()
+        os.makedirs(tmp_path / str(submission._id))
+        SubmissionRecord.objects.create(
+            program=published_form.program, form=published_form.slug,
+            submission=submission._id, number=10,
+            type=SubmissionRecord.RecordType.FILES
+        )
+        submissions.append(submission)
+
+    # the first submission's file is still used by an item
+    published_form.item_model(
+        _submission=submissions[0], _collection=collection_block_main.name,
+        _block=collection_block_main.id,
+        _file=f'{submissions[0]._id}/a.txt', _filesize=10
+    ).save()
+    yield submissions
+    SubmissionRecord.objects.filter(
+        submission__in=[ s._id for s in submissions ]
+    ).delete()
+    model.objects.filter(_email__startswith='purge').delete()
+
+def test_purge_files(published_form, files_records, tmp_path):
+    from formative.tasks import purge_submission_files
+
+    used, unused = files_records
+    purge_submission_files(published_form.id, 'all')
+    assert os.listdir(tmp_path) == [str(used._id)]
+    records = SubmissionRecord.objects.filter(
+        type=SubmissionRecord.RecordType.FILES,
+        submission__in=[used._id, unused._id]
+    )
+    assert dict(records.values_list('submission', 'deleted')) == {
+        used._id: False, unused._id: True
+    }
+    assert published_form.files_purge_progress() is None
+
+def test_purge_files_failed(published_form, files_records, monkeypatch):
+    from formative.tasks import purge_submission_files
+
+    def fail(submission_ids): raise OSError
+    monkeypatch.setattr('formative.models.formative.remove_submission_dirs',
+                        fail)
+    with pytest.raises(OSError):
+        purge_submission_files(published_form.id, 'all')
+    # the admin can start another purge
+    assert published_form.files_purge_progress() is None
@@ -0,0 +1,26 @@
+import pytest
+
+from formative import plugins
+
+
+class Meta: pass
+class Nested: pass
+
+@pytest.fixture
+def plugin_index(monkeypatch):
+    # a plugin, and one installed after it inside its package
+    index = {'plugin': Meta, 'plugin.nested': Nested}
+    monkeypatch.setattr(plugins, 'plugin_index', index)
+    monkeypatch.setattr(plugins, 'matching_plugins', {})
+    yield index
+
+def test_matching_plugin(plugin_index):
+    assert plugins.get_matching_plugin('plugin') is Meta
+    assert plugins.get_matching_plugin('plugin.signals') is Meta
+    assert plugins.get_matching_plugin('pluginx.signals') is None
+    assert plugins.get_matching_plugin('other') is None
+
+def test_matching_plugin_order(plugin_index):
+    # the first installed app containing the module, as in INSTALLED_APPS
+    assert plugins.get_matching_plugin('plugin.nested.signals') is Meta
+    assert plugins.matching_plugins['plugin.nested.signals'] is Meta
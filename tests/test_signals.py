@@ -0,0 +1,42 @@
+import pytest
+import gc, weakref
+
+from formative.signals import FormPluginSignal
+
+
+class AllActiveSignal(FormPluginSignal):
+    # every receiver is active, whatever the form's plugins
+    def _is_active(self, sender, receiver, plugins=None): return True
+
+def test_weak_receivers(program_form):
+    signal = AllActiveSignal()
+    def receiver(**kwargs): return 'received'
+    signal.connect(receiver)
+
+    responses = signal.send(program_form)
+    assert [ response for _, response in responses ] == ['received']
+    assert signal.send(program_form)[0][1] == 'received' # cached
+    del responses
+
+    # the form's cached receivers don't keep it alive
+    ref = weakref.ref(receiver)
+    del receiver
+    gc.collect()
+    assert ref() is None
+    assert signal.send(program_form) == []
+
+def test_strong_receivers(program_form):
+    signal = AllActiveSignal()
+    class Receiver:
+        def __call__(self, **kwargs): return 'received'
+        def method(self, **kwargs): return 'method'
+    receiver = Receiver()
+    signal.connect(receiver, weak=False)
+    signal.connect(receiver.method)
+
+    assert signal.send(program_form)[0][1] == 'received'
+    del receiver
+    gc.collect()
+    # the bound method's instance is kept by the strong connection
+    assert [ r for _, r in signal.send(program_form) ] == ['received',
+                                                           'method']
@@ -0,0 +1,41 @@
+import pytest
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from formative.middleware import SitesMiddleware
+from formative.models import Site
+
+
+@pytest.fixture
+def middleware(db_no_rollback, settings):
+    settings.ALLOWED_HOSTS = ['*']
+    # the response is the time zone the request was handled in
+    yield SitesMiddleware(lambda request: timezone.get_current_timezone_name())
+    Site.objects.filter(domain__endswith='.example.com').delete()
+    Site.objects.clear_cache()
+
+def test_new_host(middleware, rf, django_assert_num_queries):
+    request = rf.get('/', HTTP_HOST='new.example.com')
+    middleware(request)
+    assert request.site.domain == 'new.example.com'
+
+    # found by the next request, and then in Django's SITE_CACHE
+    request = rf.get('/', HTTP_HOST='new.example.com')
+    with django_assert_num_queries(1): middleware(request)
+    with django_assert_num_queries(0):
+        request = rf.get('/', HTTP_HOST='new.example.com')
+        middleware(request)
+        assert request.site.domain == 'new.example.com'
+
+def test_time_zone_changed(middleware, rf):
+    site = Site(domain='tz.example.com', name='tz',
+                time_zone='America/New_York')
+    site.save()
+    assert middleware(rf.get('/', HTTP_HOST=site.domain)) == 'America/New_York'
+
+    # changed in another process, which then bumped the version
+    Site.objects.filter(pk=site.pk).update(time_zone='Europe/Paris')
+    assert middleware(rf.get('/', HTTP_HOST=site.domain)) == 'America/New_York'
+    cache.set('sites_version', (cache.get('sites_version') or 0) + 1)
+    assert middleware(rf.get('/', HTTP_HOST=site.domain)) == 'Europe/Paris'
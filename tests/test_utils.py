@@ -0,0 +1,144 @@
+import pytest
+import os
+
+from formative.utils import read_ahead, submission_file_paths
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+
+    def write(path, data):
+        os.makedirs(os.path.dirname(tmp_path / path), exist_ok=True)
+        with open(tmp_path / path, 'wb') as f: f.write(data)
+
+    write('1/id.txt', b'1')
+    write('1/a.txt', b'a' * 10)
+    write('1/b.txt', b'b' * 3)
+    write('2/c.txt', b'c' * 25)
+    yield write
+
+def test_read_ahead(media):
+    paths = ['1/a.txt', '1/b.txt', '2/c.txt']
+    files = [ (path, b''.join(chunks))
+              for path, chunks in read_ahead(paths, chunk_size=4, depth=2) ]
+
+    assert files == [('1/a.txt', b'a' * 10), ('1/b.txt', b'b' * 3),
+                     ('2/c.txt', b'c' * 25)]
+
+def test_read_ahead_chunks(media):
+    for path, chunks in read_ahead(['2/c.txt'], chunk_size=10, depth=1):
+        assert [ len(chunk) for chunk in chunks ] == [10, 10, 5]
+
+def test_read_ahead_missing(media):
+    with pytest.raises(FileNotFoundError):
+        for path, chunks in read_ahead(['1/a.txt', '1/nope.txt']):
+            for chunk in chunks: pass
+
+def test_read_ahead_stopped(media):
+    # abandoning the generator, like a client that went away, is fine
+    files = read_ahead(['1/a.txt', '1/b.txt', '2/c.txt'], chunk_size=1, depth=1)
+    path, chunks = next(files)
+    assert path == '1/a.txt'
+    files.close()
+
+def test_submission_file_paths(media):
+    files = [ (10, 1, '1/a.txt'), (11, 1, '1/gone.txt'), (12, 1, '1/b.txt'),
+              (13, 2, '2/c.txt'), (14, 3, '3/d.txt') ]
+
+    # the submission's id.txt is included once, if it has files
+    assert list(submission_file_paths(files)) == [
+        '1/id.txt', '1/a.txt', '1/b.txt', '2/c.txt'
+    ]
+
+def test_submission_file_paths_since(media):
+    files = [ (10, 1, '1/a.txt'), (12, 1, '1/b.txt'), (13, 2, '2/c.txt') ]
+    manifest = {}
+    assert len(list(submission_file_paths(files, manifest=manifest))) == 4
+    assert set(manifest) == {'10', '12', '13'}
+    assert manifest['10'][0] == 10
+
+    # nothing has changed since
+    update = {}
+    assert list(submission_file_paths(files, since=manifest,
+                                      manifest=update)) == []
+    assert update == manifest
+
+    # a rewritten file is included again, with its submission's id.txt
+    media('1/b.txt', b'b' * 4)
+    assert list(submission_file_paths(files, since=manifest)) == [
+        '1/id.txt', '1/b.txt'
+    ]
+    # an item not in the earlier manifest is new
+    del manifest['13']
+    assert list(submission_file_paths(files[2:], since=manifest)) == ['2/c.txt']
+
+def test_add_missing_indexes(published_form):
+    from django.db import connection
+    from formative.utils import add_missing_indexes
+
+    model = published_form.model
+    table = model._meta.db_table
+    def indexes():
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor,
+                                                                   table)
+        return { tuple(c['columns']) for c in constraints.values()
+                 if c['index'] }
+
+    # a table published before _created had an index
+    field = model._meta.get_field('_created')
+    old_field = field.clone()
+    old_field.set_attributes_from_name('_created')
+    old_field.db_index = False
+    with connection.schema_editor() as editor:
+        editor.alter_field(model, field, old_field)
+    assert ('_created',) not in indexes()
+
+    with connection.schema_editor(atomic=False) as editor:
+        assert len(add_missing_indexes(model, editor)) == 1
+        assert add_missing_indexes(model, editor) == []
+    assert ('_created',) in indexes()
+
+def test_add_item_indexes_partitioned(published_form, partitioned_form):
+    from django.core.management import call_command
+    from django.db import connection
+    from io import StringIO
+
+    table = partitioned_form.model._meta.db_table
+    def indexes():
+        # each index, whether it's valid, and the partitions with theirs
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT c.relname, i.indisvalid, array_agg('
+                           'p.indrelid::regclass::text) '
+                           'FROM pg_index i JOIN pg_class c '
+                           'ON c.oid = i.indexrelid LEFT JOIN pg_inherits h '
+                           'ON h.inhparent = i.indexrelid LEFT JOIN pg_index p '
+                           'ON p.indexrelid = h.inhrelid '
+                           'WHERE i.indrelid = %s::regclass '
+                           'GROUP BY 1, 2', [table])
+            return { name: (valid, parts) for name, valid, parts
+                     in cursor.fetchall() }
+
+    # a partitioned table published before _created had an index
+    with connection.cursor() as cursor:
+        for name in indexes():
+            constraints = connection.introspection.get_constraints(cursor,
+                                                                   table)
+            if constraints[name]['columns'] == ['_created']:
+                cursor.execute(f'DROP INDEX "{name}"')
+    out = StringIO()
+    call_command('add_item_indexes', stdout=out)
+    assert f'{table}: added' in out.getvalue()
+
+    parent = indexes()
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    columns = { tuple(constraints[name]['columns']) for name in parent }
+    assert {('_created',), ('_modified',), ('_submitted',)} <= columns
+    for valid, partitions in parent.values():
+        assert valid and sorted(partitions) == [table + '_d', table + '_s']
+
+    out = StringIO()
+    call_command('add_item_indexes', stdout=out)
+    assert table not in out.getvalue()